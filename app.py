@@ -1,132 +1,340 @@
 import streamlit as st
+import gzip
+import io
 import os
-import psycopg2
-from psycopg2 import sql
-from datetime import datetime
-import requests
+import secrets
+import threading
+import time
+import metrics
+import timing
+from datetime import datetime, timedelta
+from questionnaire import QUESTIONS, SECTIONS, field_labels, widget_key
+from results import ANSWER_CODES, encode_result
+from scoring import (TIERS, missing_answers, risk_tier, score_cache_info,
+                     score_cached)
+from storage import get_storage
+from telemetry import TelemetryWriter
+from timing import span, timed
+from translations import LANGUAGES, check_catalogs, get_translations
+
+# Counters are buffered in memory and written by a background thread
+@st.cache_resource
+def get_telemetry():
+    # One storage per server process, shared by every session thread; the
+    # backend module (psycopg2 for Postgres) is loaded on first use, so the
+    # patient-facing page never imports it
+    writer = TelemetryWriter(get_storage).start()
+    metrics.QUEUE_DEPTH.set_function(writer.pending)
+    metrics.DROPPED_EVENTS.set_function(lambda: writer.dropped)
+    metrics.SPOOLED_EVENTS.set_function(writer.spooled_events)
+    return writer
+
+
+# Prometheus scrape endpoint (METRICS_PORT), one per server process
+@st.cache_resource
+def start_metrics_server():
+
+    def breaker_open():
+        breaker = get_storage().breaker
+        return int(breaker is not None and breaker.is_open)
+
+    metrics.DB_BREAKER_OPEN.set_function(breaker_open)
+    metrics.SCORE_CACHE_HITS.set_function(lambda: score_cache_info().hits)
+    metrics.SCORE_CACHE_MISSES.set_function(
+        lambda: score_cache_info().misses)
+    return metrics.start_server(int(os.environ["METRICS_PORT"]),
+                                os.environ.get("METRICS_HOST", "127.0.0.1"))
+
+
+def increment_counter(counter_name='assessments'):
+    try:
+        get_telemetry().record(counter_name)
+    except Exception as e:
+        pass
+
+
+def record_result(answers, points, emergency_override, tier, language):
+    try:
+        get_telemetry().record_result(
+            encode_result(answers, points, emergency_override, tier,
+                          language))
+    except Exception as e:
+        pass
+
+
+def get_counter(counter_name='assessments'):
+    try:
+        telemetry = get_telemetry()
+        return get_storage().get_counter(counter_name) + telemetry.pending(
+            counter_name)
+    except Exception as e:
+        return 0
+
+
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static",
+                          "exports")
+EXPORT_MAX_AGE = 3600
+# Streamlit's static file server refuses files over 200 MB; parts are
+# closed a little below that
+EXPORT_PART_SIZE = 190 * 1024 * 1024
+
+
+class ExportParts(io.RawIOBase):
+    """Binary sink that gzips what it is given into numbered part files.
+
+    A part is closed at the next line end once it reaches part_size, so
+    each part holds whole CSV lines, and the parts concatenated in order
+    are one valid .csv.gz file.
+    """
+
+    def __init__(self, prefix, part_size=EXPORT_PART_SIZE):
+        self.prefix = prefix
+        self.part_size = part_size
+        self.names = []
+        self._open_part()
+
+    def _open_part(self):
+        self.names.append(f"{self.prefix}-{len(self.names) + 1}.csv.gz")
+        self._file = open(os.path.join(EXPORT_DIR, self.names[-1] + ".part"),
+                          "wb")
+        self._gzip = gzip.GzipFile(fileobj=self._file, mode="wb")
+
+    def _close_part(self):
+        self._gzip.close()
+        self._file.close()
+        path = os.path.join(EXPORT_DIR, self.names[-1])
+        os.replace(path + ".part", path)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        if self._file.tell() >= self.part_size:
+            end = data.find(b"\n") + 1
+            if end:
+                self._gzip.write(data[:end])
+                self._close_part()
+                self._open_part()
+                self._gzip.write(data[end:])
+                return len(data)
+        self._gzip.write(data)
+        return len(data)
+
+    def finish(self):
+        """Close the last part and return the part file names."""
+        self._close_part()
+        return self.names
+
+    def abort(self):
+        """Close and delete every part, for an export that failed."""
+        try:
+            self._gzip.close()
+        finally:
+            self._file.close()
+            os.remove(os.path.join(EXPORT_DIR, self.names[-1] + ".part"))
+            for name in self.names[:-1]:
+                os.remove(os.path.join(EXPORT_DIR, name))
+
+
+def export_view_log():
+    """Write the full view log to fresh gzipped CSV parts; return their names."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    now = time.time()
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        if now - os.path.getmtime(path) > EXPORT_MAX_AGE:
+            os.remove(path)
+
+    parts = ExportParts(f"view_log-{secrets.token_urlsafe(16)}")
+    try:
+        get_storage().copy_view_log_csv(parts)
+    except Exception:
+        parts.abort()
+        raise
+    return parts.finish()
+
+
+@st.cache_data(ttl=60)
+def load_rollups(field, days):
+    """Return rollup counts since `days` ago, one column per view type."""
+    import pandas as pd
+    since = datetime.now() - timedelta(days=days)
+    rows = get_storage().get_rollups(field, since)
+    df = pd.DataFrame(rows, columns=["Bucket", "Type", "Count"])
+    return df.pivot_table(index="Bucket",
+                          columns="Type",
+                          values="Count",
+                          fill_value=0)
+
+
+@st.cache_data(ttl=60)
+def load_result_stats(days):
+    """Return tier counts and answer prevalence since `days` ago (or ever).
+
+    Both are summed by the database from daily rollups, so they cost the
+    same however many results are stored.
+    """
+    import pandas as pd
+    since = datetime.now() - timedelta(days=days) if days else None
+    storage = get_storage()
+    tiers = pd.DataFrame(
+        storage.get_tier_counts(since),
+        columns=["Language", "Tier", "Assessments", "Emergency"])
+    t = get_translations("English")
+    labels = get_field_labels("English")
+    # Questionnaire order; codes since removed from it go last, unlabelled
+    order = {(question, option): i
+             for i, (_, _, question, option) in enumerate(ANSWER_CODES)}
+    rows = sorted(storage.get_answer_prevalence(since),
+                  key=lambda row: order.get(row[:2], len(order)))
+    prevalence = pd.DataFrame(
+        [(labels.get(question, question), t.get(option, option), count,
+          share * 100) for question, option, count, share in rows],
+        columns=["Question", "Answer", "Assessments", "Share"])
+    return tiers, prevalence
+
+
+RESULT_PERIODS = {
+    "Last 7 Days": 7,
+    "Last 30 Days": 30,
+    "Last 365 Days": 365,
+    "All Time": None,
+}
+
 
-# Cache database initialization to avoid running on every reload
+def result_analytics():
+    """Show tier distribution, emergency rate and answer prevalence."""
+    period = st.selectbox("Period", list(RESULT_PERIODS), index=1,
+                          key="result_period")
+    tiers, prevalence = load_result_stats(RESULT_PERIODS[period])
+    total = int(tiers["Assessments"].sum())
+    if not total:
+        st.info("No assessment results stored for this period.")
+        return
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Stored Results", f"{total:,}")
+    with col2:
+        st.metric("Emergency Override Rate",
+                  f"{tiers['Emergency'].sum() / total:.1%}")
+    st.bar_chart(
+        tiers.pivot_table(index="Tier",
+                          columns="Language",
+                          values="Assessments",
+                          fill_value=0).reindex(TIERS, fill_value=0))
+    st.dataframe(prevalence,
+                 column_config={
+                     "Share": st.column_config.NumberColumn(format="%.1f%%")
+                 },
+                 use_container_width=True,
+                 hide_index=True)
+
+
+VIEW_LOG_PAGE_SIZE = 50
+VIEW_LOG_REFRESH = 5
+# Ids below the highest seen that are re-read on each refresh. Ids are
+# taken at insert, so a transaction committing late can add lower ones.
+VIEW_LOG_ID_OVERLAP = 1000
+
+
+def view_log_browser():
+    """Show the view log one keyset page at a time.
+
+    The newest page only fetches rows from VIEW_LOG_ID_OVERLAP below the
+    highest id it has seen, so late or replayed rows with older timestamps
+    still show up, and older pages are fetched once, so refreshes cost
+    O(new rows + overlap).
+    """
+    import pandas as pd
+    state = st.session_state
+    if "view_log_pages" not in state:
+        # (timestamp, id) key each visited page starts before; None = newest
+        state.view_log_pages = [None]
+        state.view_log_newest = []
+        state.view_log_last_id = None
+        state.view_log_cache = {}
+
+    try:
+        before = state.view_log_pages[-1]
+        if before is None:
+            last_id = state.view_log_last_id
+            new_rows = get_storage().get_view_log_page(
+                VIEW_LOG_PAGE_SIZE,
+                after_id=None if last_id is None else max(
+                    last_id - VIEW_LOG_ID_OVERLAP, 0))
+            if new_rows:
+                state.view_log_last_id = max(
+                    last_id or 0, max(row[0] for row in new_rows))
+            # Rows in the overlap may already be shown
+            merged = {row[0]: row for row in state.view_log_newest + new_rows}
+            rows = state.view_log_newest = sorted(
+                merged.values(),
+                key=lambda row: (row[2], row[0]),
+                reverse=True)[:VIEW_LOG_PAGE_SIZE]
+        else:
+            if before not in state.view_log_cache:
+                state.view_log_cache[before] = (
+                    get_storage().get_view_log_page(VIEW_LOG_PAGE_SIZE,
+                                                    before=before))
+            rows = state.view_log_cache[before]
+    except Exception as e:
+        st.error(f"Could not load view log: {str(e)}")
+        return
+
+    if not rows and before is None:
+        st.info("No views recorded yet.")
+        return
+
+    df = pd.DataFrame([row[1:] for row in rows],
+                      columns=["Type", "Timestamp"])
+    st.dataframe(df, use_container_width=True)
+
+    # Callbacks run before the next rerun, so the new page renders at once
+    col1, col2, col3 = st.columns([1, 1, 4])
+    with col1:
+        st.button("← Newer",
+                  disabled=before is None,
+                  on_click=state.view_log_pages.pop)
+    with col2:
+        st.button("Older →",
+                  disabled=len(rows) < VIEW_LOG_PAGE_SIZE,
+                  on_click=state.view_log_pages.append,
+                  args=((rows[-1][2], rows[-1][0]), ))
+    with col3:
+        st.caption(f"Page {len(state.view_log_pages)}")
+
+
+# Visitor notifications go out as periodic digests from a background
+# worker, only when SENDGRID_API_KEY and NOTIFY_EMAIL are set
 @st.cache_resource
-def get_db_connection():
-    return psycopg2.connect(os.environ.get("DATABASE_URL"))
-
-# @st.cache_resource
-# def init_counter_table():
-#     try:
-#         conn = psycopg2.connect(os.environ.get("DATABASE_URL"))
-#         cur = conn.cursor()
-#         cur.execute("""
-#             CREATE TABLE IF NOT EXISTS view_counter (
-#                 id SERIAL PRIMARY KEY,
-#                 counter_name VARCHAR(50) UNIQUE NOT NULL,
-#                 count INTEGER DEFAULT 0
-#             )
-#         """)
-#         cur.execute("""
-#             INSERT INTO view_counter (counter_name, count) 
-#             VALUES ('assessments', 0) 
-#             ON CONFLICT (counter_name) DO NOTHING
-#         """)
-#         cur.execute("""
-#             INSERT INTO view_counter (counter_name, count) 
-#             VALUES ('page_views', 0) 
-#             ON CONFLICT (counter_name) DO NOTHING
-#         """)
-#         cur.execute("""
-#             CREATE TABLE IF NOT EXISTS view_log (
-#                 id SERIAL PRIMARY KEY,
-#                 view_type VARCHAR(50) NOT NULL,
-#                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-#             )
-#         """)
-#         conn.commit()
-#         cur.close()
-#         conn.close()
-#         return True
-#     except Exception as e:
-#         return False
-
-# def increment_counter(counter_name='assessments'):
-#     try:
-#         conn = psycopg2.connect(os.environ.get("DATABASE_URL"))
-#         cur = conn.cursor()
-#         cur.execute(
-#             """
-#             UPDATE view_counter SET count = count + 1 
-#             WHERE counter_name = %s
-#             RETURNING count
-#         """, (counter_name, ))
-#         result = cur.fetchone()
-#         cur.execute(
-#             """
-#             INSERT INTO view_log (view_type, timestamp) 
-#             VALUES (%s, %s)
-#         """, (counter_name, datetime.now()))
-#         conn.commit()
-#         cur.close()
-#         conn.close()
-#         return result[0] if result else 0
-#     except Exception as e:
-#         return 0
-
-
-# def get_counter(counter_name='assessments'):
-#     try:
-#         conn = psycopg2.connect(os.environ.get("DATABASE_URL"))
-#         cur = conn.cursor()
-#         cur.execute("SELECT count FROM view_counter WHERE counter_name = %s",
-#                     (counter_name, ))
-#         result = cur.fetchone()
-#         cur.close()
-#         conn.close()
-#         return result[0] if result else 0
-#     except Exception as e:
-#         return 0
-
-# def send_view_notification():
-#     """Send email notification when someone views the app"""
-#     try:
-#         api_key = os.environ.get("SENDGRID_API_KEY")
-#         notify_email = os.environ.get("NOTIFY_EMAIL")
-#         if not api_key or not notify_email:
-#             return False
-
-#         url = "https://api.sendgrid.com/v3/mail/send"
-#         headers = {
-#             "Authorization": f"Bearer {api_key}",
-#             "Content-Type": "application/json"
-#         }
-
-#         # current_views = get_counter('page_views')
-#         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-#         data = {
-#             "personalizations": [{
-#                 "to": [{
-#                     "email": notify_email
-#                 }]
-#             }],
-#             "from": {
-#                 "email": notify_email
-#             },
-#             "subject":
-#             f"Retinal Risk App - New Visitor (Total: {current_views})",
-#             "content": [{
-#                 "type":
-#                 "text/plain",
-#                 "value":
-#                 f"Someone opened the Retinal Detachment Risk Assessment app.\n\nTime: {current_time}\nTotal Page Views: {current_views}"
-#             }]
-#         }
-
-#         response = requests.post(url, headers=headers, json=data, timeout=5)
-#         return response.status_code == 202
-#     except Exception as e:
-#         return False
-
-
-# Initialize counter table on startup
-# init_counter_table()
+def get_notifier():
+    api_key = os.environ.get("SENDGRID_API_KEY")
+    notify_email = os.environ.get("NOTIFY_EMAIL")
+    if not api_key or not notify_email:
+        return None
+    from notifications import NotificationDigest
+    return NotificationDigest(
+        api_key,
+        notify_email,
+        interval=float(os.environ.get("NOTIFY_DIGEST_MINUTES", "60")) * 60,
+        max_visits=int(os.environ.get("NOTIFY_DIGEST_VISITS", "50")),
+        get_total_views=total_page_views).start()
+
+
+def total_page_views():
+    return get_storage().get_counter('page_views')
+
+
+def send_view_notification():
+    """Count this visit towards the next notification digest."""
+    try:
+        notifier = get_notifier()
+        if notifier is not None:
+            notifier.record_visit()
+    except Exception as e:
+        pass
+
 
 # Page configuration
 st.set_page_config(page_title="Retinal Detachment Risk Assessment",
@@ -135,7 +343,7 @@ st.set_page_config(page_title="Retinal Detachment Risk Assessment",
                    initial_sidebar_state="collapsed")
 
 # Custom CSS for better UI
-st.markdown("""
+PAGE_CSS = """
 <style>
     .main > div {
         padding-top: 2rem;
@@ -194,552 +402,10 @@ st.markdown("""
         font-weight: 700 !important;
     }
 </style>
-""",
-            unsafe_allow_html=True)
-
-# Translations
-TRANSLATIONS = {
-    "English": {
-        "title":
-        "👁️ Retinal Detachment Awareness Check",
-        "subtitle":
-        "This tool helps determine how urgently you should see an eye care professional based on your risk factors and symptoms.",
-        "language":
-        "Language:",
-        "section_a":
-        "📋 A) Demographics",
-        "age":
-        "Age (years): *",
-        "age_placeholder":
-        "Enter your age",
-        "sex":
-        "Sex assigned at birth: *",
-        "female":
-        "Female",
-        "male":
-        "Male",
-        "section_b":
-        "👁️ B) Eye History",
-        "prior_rd":
-        "Ever diagnosed with retinal detachment in either eye? *",
-        "cataract":
-        "Cataract surgery in this eye? *",
-        "yag":
-        "Nd:YAG posterior capsulotomy (laser) in this eye? *",
-        "myopia":
-        "Do you wear glasses/contacts for nearsightedness (myopia)? *",
-        "myopia_level":
-        "Approximate prescription: *",
-        "myopia_none":
-        "None",
-        "myopia_mild":
-        "Mild (< -3D)",
-        "myopia_moderate":
-        "Moderate (-3 to -6D)",
-        "myopia_high":
-        "High (≤ -6D)",
-        "dont_know":
-        "Don't know",
-        "retinal_condition":
-        "Any known retinal condition (e.g., lattice degeneration) diagnosed by an eye doctor (this eye)? *",
-        "eye_trauma":
-        "Any prior significant eye trauma to this eye? *",
-        "yes":
-        "Yes",
-        "no":
-        "No",
-        "not_sure":
-        "Not sure",
-        "section_c":
-        "🧬 C) Systemic / Family History",
-        "diabetes":
-        "Do you have diabetes? *",
-        "family_history":
-        "Family history of retinal detachment? *",
-        "section_d":
-        "⚠️ D) Current Symptoms",
-        "floaters":
-        "New floaters in the last few days (this eye)? *",
-        "floaters_onset":
-        "If yes, started: *",
-        "flashes":
-        "Flashes of light in the last few days (this eye)? *",
-        "flashes_none":
-        "None",
-        "flashes_occasional":
-        "Occasional",
-        "flashes_frequent":
-        "Frequent",
-        "flashes_onset":
-        "If occasional/frequent, started: *",
-        "shadow":
-        "Dark shadow/curtain/veil in vision (this eye)? *",
-        "shadow_onset":
-        "If yes, how long ago? *",
-        "vision_decrease":
-        "Sudden decrease in vision (this eye)? *",
-        "vision_onset":
-        "If yes, onset: *",
-        "pain":
-        "New double vision or severe eye pain (this eye)? *",
-        "onset_48h":
-        "Within 48 hours",
-        "onset_more_48h":
-        "More than 48 hours ago",
-        "onset_24h":
-        "Within 24 hours",
-        "onset_more_24h":
-        "More than 24 hours ago",
-        "section_e":
-        "📊 E) Visual Function & Follow-up",
-        "vision_level":
-        "Approximate vision in this eye (without correction): *",
-        "vision_2020":
-        "20/20 or better (0D)",
-        "vision_2030":
-        "20/30–20/60 (-0.5D to -1.5D)",
-        "vision_2080":
-        "20/80–20/200 (-2.0D to -4.0D)",
-        "vision_worse":
-        "Worse than 20/200 (> -4.0D)",
-        "last_exam":
-        "Date of last dilated eye exam (if known): *",
-        "exam_within_2":
-        "Within 2 years",
-        "exam_more_2":
-        "More than 2 years ago",
-        "exam_never":
-        "Never",
-        "section_f":
-        "🏋️ F) Lifestyle / Recent Triggers",
-        "triggers":
-        "Recent potential triggers in the last 3 months (check all that apply): *",
-        "trigger_trauma":
-        "Heavy head/eye trauma",
-        "trigger_sports":
-        "Contact sports",
-        "trigger_lifting":
-        "Heavy lifting/physical strain immediately before symptoms",
-        "trigger_none":
-        "None",
-        "calculate_btn":
-        "🔍 Calculate My Risk Assessment",
-        "reset_btn":
-        "🔄 Start New Assessment",
-        "missing_fields":
-        "⚠️ Please complete all required fields (*) before calculating. Missing:",
-        "results_title":
-        "Your Risk Assessment Results",
-        "disclaimer":
-        "**Disclaimer:** This tool provides educational guidance on how urgently to seek an eye care evaluation based on your answers. It does not diagnose retinal detachment and does not replace an exam by an eye care professional. Results may not account for all individual medical factors. If you have new or worsening symptoms (especially flashes, sudden floaters, a curtain/shadow, or sudden vision changes), seek urgent eye care or emergency care.",
-        "risk_percentage":
-        "Estimated Risk Percentage",
-        "risk_tier":
-        "Risk Tier",
-        "very_high":
-        "VERY HIGH",
-        "high":
-        "HIGH",
-        "moderate":
-        "MODERATE",
-        "low":
-        "LOW",
-        "very_high_title":
-        "🚨 VERY HIGH RISK - EMERGENCY ACTION REQUIRED",
-        "very_high_msg":
-        "You are at VERY HIGH RISK for retinal detachment",
-        "very_high_action":
-        "⚠️ SEEK EMERGENCY EYE CARE TODAY (SAME DAY)",
-        "very_high_detail":
-        "Your symptoms and risk factors indicate a potential retinal detachment emergency. Contact an ophthalmologist or go to an emergency room with ophthalmology services immediately. Prompt treatment can prevent permanent vision loss.",
-        "high_title":
-        "⚠️ HIGH RISK - URGENT EVALUATION NEEDED",
-        "high_msg":
-        "You are at HIGH RISK for retinal detachment",
-        "high_action":
-        "📞 URGENT: Schedule evaluation within 24 hours",
-        "high_detail":
-        "Contact an eye care professional today to schedule an urgent examination. Your risk factors warrant prompt attention to prevent potential vision loss.",
-        "moderate_title":
-        "ℹ️ MODERATE RISK - SCHEDULE APPOINTMENT SOON",
-        "moderate_msg":
-        "You are at MODERATE RISK for retinal detachment",
-        "moderate_action":
-        "📅 Schedule eye exam within 1–3 days",
-        "moderate_detail":
-        "While not an emergency, your symptoms warrant timely evaluation. Contact your eye care provider to schedule an appointment. Seek care sooner if symptoms worsen.",
-        "low_title":
-        "✅ LOW RISK - MONITOR SYMPTOMS",
-        "low_msg":
-        "You are at LOW RISK for retinal detachment",
-        "low_action":
-        "👁️ Continue monitoring your symptoms",
-        "low_detail":
-        "Your current risk is low. Monitor your vision and seek care if you develop new symptoms such as sudden floaters, flashes of light, or vision changes. Maintain regular eye exams as recommended by your eye care provider.",
-        "important_note":
-        "💡 **Important**: This screening tool helps determine the urgency of eye care based on evidence-based risk factors. Early detection and treatment of retinal detachment can preserve vision and prevent blindness."
-    },
-    "Español": {
-        "title":
-        "👁️ Verificación de Concienciación sobre el Desprendimiento de Retina",
-        "subtitle":
-        "Esta evaluación ayuda a determinar con qué urgencia debe consultar a un profesional de la salud ocular según sus factores de riesgo y síntomas.",
-        "language":
-        "Idioma:",
-        "section_a":
-        "📋 A) Demografía",
-        "age":
-        "Edad (años): *",
-        "age_placeholder":
-        "Ingrese su edad",
-        "sex":
-        "Sexo asignado al nacer: *",
-        "female":
-        "Femenino",
-        "male":
-        "Masculino",
-        "section_b":
-        "👁️ B) Historia Ocular",
-        "prior_rd":
-        "¿Alguna vez fue diagnosticado con desprendimiento de retina en cualquier ojo? *",
-        "cataract":
-        "¿Cirugía de cataratas en este ojo? *",
-        "yag":
-        "¿Capsulotomía posterior Nd:YAG (láser) en este ojo? *",
-        "myopia":
-        "¿Usa lentes/lentes de contacto para miopía? *",
-        "myopia_level":
-        "Prescripción aproximada: *",
-        "myopia_none":
-        "Ninguna",
-        "myopia_mild":
-        "Leve (< -3D)",
-        "myopia_moderate":
-        "Moderada (-3 a -6D)",
-        "myopia_high":
-        "Alta (≤ -6D)",
-        "dont_know":
-        "No sé",
-        "retinal_condition":
-        "¿Alguna condición retiniana conocida (ej., degeneración lattice) diagnosticada por un oftalmólogo (este ojo)? *",
-        "eye_trauma":
-        "¿Algún trauma ocular significativo previo en este ojo? *",
-        "yes":
-        "Sí",
-        "no":
-        "No",
-        "not_sure":
-        "No estoy seguro/a",
-        "section_c":
-        "🧬 C) Historia Sistémica / Familiar",
-        "diabetes":
-        "¿Tiene diabetes? *",
-        "family_history":
-        "¿Historia familiar de desprendimiento de retina? *",
-        "section_d":
-        "⚠️ D) Síntomas Actuales",
-        "floaters":
-        "¿Nuevas moscas volantes en los últimos días (este ojo)? *",
-        "floaters_onset":
-        "Si es sí, comenzó: *",
-        "flashes":
-        "¿Destellos de luz en los últimos días (este ojo)? *",
-        "flashes_none":
-        "Ninguno",
-        "flashes_occasional":
-        "Ocasionales",
-        "flashes_frequent":
-        "Frecuentes",
-        "flashes_onset":
-        "Si ocasionales/frecuentes, comenzó: *",
-        "shadow":
-        "¿Sombra/cortina/velo oscuro en la visión (este ojo)? *",
-        "shadow_onset":
-        "Si es sí, ¿hace cuánto tiempo? *",
-        "vision_decrease":
-        "¿Disminución repentina de la visión (este ojo)? *",
-        "vision_onset":
-        "Si es sí, inicio: *",
-        "pain":
-        "¿Visión doble nueva o dolor ocular severo (este ojo)? *",
-        "onset_48h":
-        "Dentro de 48 horas",
-        "onset_more_48h":
-        "Hace más de 48 horas",
-        "onset_24h":
-        "Dentro de 24 horas",
-        "onset_more_24h":
-        "Hace más de 24 horas",
-        "section_e":
-        "📊 E) Función Visual y Seguimiento",
-        "vision_level":
-        "Visión aproximada en este ojo (sin corrección): *",
-        "vision_2020":
-        "20/20 o mejor (0D)",
-        "vision_2030":
-        "20/30–20/60 (-0.5D a -1.5D)",
-        "vision_2080":
-        "20/80–20/200 (-2.0D a -4.0D)",
-        "vision_worse":
-        "Peor que 20/200 (> -4.0D)",
-        "last_exam":
-        "Fecha del último examen ocular con dilatación (si se conoce): *",
-        "exam_within_2":
-        "Dentro de 2 años",
-        "exam_more_2":
-        "Hace más de 2 años",
-        "exam_never":
-        "Nunca",
-        "section_f":
-        "🏋️ F) Estilo de Vida / Desencadenantes Recientes",
-        "triggers":
-        "Desencadenantes potenciales recientes en los últimos 3 meses (marque todos los que apliquen): *",
-        "trigger_trauma":
-        "Trauma fuerte en cabeza/ojos",
-        "trigger_sports":
-        "Deportes de contacto",
-        "trigger_lifting":
-        "Levantamiento pesado/esfuerzo físico inmediatamente antes de los síntomas",
-        "trigger_none":
-        "Ninguno",
-        "calculate_btn":
-        "🔍 Calcular Mi Evaluación de Riesgo",
-        "reset_btn":
-        "🔄 Iniciar Nueva Evaluación",
-        "missing_fields":
-        "⚠️ Por favor complete todos los campos requeridos (*) antes de calcular. Faltan:",
-        "results_title":
-        "Resultados de Su Evaluación de Riesgo",
-        "disclaimer":
-        "**Descargo de responsabilidad:** Este evaluador de riesgo de desprendimiento de retina proporciona orientación sobre la urgencia con la que debe buscar una evaluación de atención ocular según sus respuestas. No establece un diagnóstico ni reemplaza un examen por un profesional de atención ocular. Las recomendaciones pueden no tener en cuenta todos los factores médicos individuales. Si experimenta síntomas nuevos o que empeoran, comuníquese con un especialista ocular calificado inmediatamente o busque atención de emergencia.",
-        "risk_percentage":
-        "Porcentaje de Riesgo Estimado",
-        "risk_tier":
-        "Nivel de Riesgo",
-        "very_high":
-        "MUY ALTO",
-        "high":
-        "ALTO",
-        "moderate":
-        "MODERADO",
-        "low":
-        "BAJO",
-        "very_high_title":
-        "🚨 RIESGO MUY ALTO - ACCIÓN DE EMERGENCIA REQUERIDA",
-        "very_high_msg":
-        "Usted está en RIESGO MUY ALTO de desprendimiento de retina",
-        "very_high_action":
-        "⚠️ BUSQUE ATENCIÓN OFTALMOLÓGICA DE EMERGENCIA HOY (MISMO DÍA)",
-        "very_high_detail":
-        "Sus síntomas y factores de riesgo indican una posible emergencia de desprendimiento de retina. Contacte a un oftalmólogo o vaya a una sala de emergencias con servicios de oftalmología inmediatamente. El tratamiento rápido puede prevenir la pérdida permanente de la visión.",
-        "high_title":
-        "⚠️ RIESGO ALTO - EVALUACIÓN URGENTE NECESARIA",
-        "high_msg":
-        "Usted está en RIESGO ALTO de desprendimiento de retina",
-        "high_action":
-        "📞 URGENTE: Programe evaluación dentro de 24 horas",
-        "high_detail":
-        "Contacte a un profesional del cuidado ocular hoy para programar un examen urgente. Sus factores de riesgo requieren atención inmediata para prevenir la pérdida potencial de la visión.",
-        "moderate_title":
-        "ℹ️ RIESGO MODERADO - PROGRAME CITA PRONTO",
-        "moderate_msg":
-        "Usted está en RIESGO MODERADO de desprendimiento de retina",
-        "moderate_action":
-        "📅 Programe examen ocular dentro de 1–3 días",
-        "moderate_detail":
-        "Aunque no es una emergencia, sus síntomas requieren evaluación oportuna. Contacte a su proveedor de cuidado ocular para programar una cita. Busque atención antes si los síntomas empeoran.",
-        "low_title":
-        "✅ RIESGO BAJO - MONITOREE SÍNTOMAS",
-        "low_msg":
-        "Usted está en RIESGO BAJO de desprendimiento de retina",
-        "low_action":
-        "👁️ Continúe monitoreando sus síntomas",
-        "low_detail":
-        "Su riesgo actual es bajo. Monitoree su visión y busque atención si desarrolla nuevos síntomas como moscas volantes repentinas, destellos de luz o cambios en la visión. Mantenga exámenes oculares regulares según lo recomendado por su proveedor de cuidado ocular.",
-        "important_note":
-        "💡 **Importante**: Esta herramienta de detección ayuda a determinar la urgencia de la atención ocular basada en factores de riesgo basados en evidencia. La detección y tratamiento tempranos del desprendimiento de retina pueden preservar la visión y prevenir la ceguera."
-    },
-    "हिंदी": {
-        "title":
-        "👁️ रेटिनल डिटैचमेंट जागरूकता जांच",
-        "subtitle":
-        "यह मूल्यांकन आपके जोखिम कारकों और लक्षणों के आधार पर यह निर्धारित करने में मदद करता है कि आपको कितनी जल्दी नेत्र चिकित्सा पेशेवर से मिलना चाहिए।",
-        "language":
-        "भाषा:",
-        "section_a":
-        "📋 A) जनसांख्यिकी",
-        "age":
-        "उम्र (वर्ष): *",
-        "age_placeholder":
-        "अपनी उम्र दर्ज करें",
-        "sex":
-        "जन्म के समय निर्धारित लिंग: *",
-        "female":
-        "महिला",
-        "male":
-        "पुरुष",
-        "section_b":
-        "👁️ B) नेत्र इतिहास",
-        "prior_rd":
-        "क्या कभी किसी भी आंख में रेटिना डिटैचमेंट का निदान हुआ है? *",
-        "cataract":
-        "इस आंख में मोतियाबिंद सर्जरी? *",
-        "yag":
-        "इस आंख में Nd:YAG पोस्टीरियर कैप्सुलोटॉमी (लेज़र)? *",
-        "myopia":
-        "क्या आप निकट दृष्टिदोष (मायोपिया) के लिए चश्मा/कॉन्टैक्ट लेंस पहनते हैं? *",
-        "myopia_level":
-        "अनुमानित प्रिस्क्रिप्शन: *",
-        "myopia_none":
-        "कोई नहीं",
-        "myopia_mild":
-        "हल्का (< -3D)",
-        "myopia_moderate":
-        "मध्यम (-3 से -6D)",
-        "myopia_high":
-        "उच्च (≤ -6D)",
-        "dont_know":
-        "पता नहीं",
-        "retinal_condition":
-        "क्या नेत्र चिकित्सक द्वारा कोई ज्ञात रेटिना स्थिति (जैसे, लैटिस डिजनरेशन) का निदान किया गया है (इस आंख में)? *",
-        "eye_trauma":
-        "इस आंख में कोई पूर्व महत्वपूर्ण आंख का आघात? *",
-        "yes":
-        "हाँ",
-        "no":
-        "नहीं",
-        "not_sure":
-        "निश्चित नहीं",
-        "section_c":
-        "🧬 C) प्रणालीगत / पारिवारिक इतिहास",
-        "diabetes":
-        "क्या आपको मधुमेह है? *",
-        "family_history":
-        "रेटिना डिटैचमेंट का पारिवारिक इतिहास? *",
-        "section_d":
-        "⚠️ D) वर्तमान लक्षण",
-        "floaters":
-        "पिछले कुछ दिनों में नए फ्लोटर्स (इस आंख में)? *",
-        "floaters_onset":
-        "यदि हाँ, शुरू हुआ: *",
-        "flashes":
-        "पिछले कुछ दिनों में प्रकाश की चमक (इस आंख में)? *",
-        "flashes_none":
-        "कोई नहीं",
-        "flashes_occasional":
-        "कभी-कभी",
-        "flashes_frequent":
-        "बार-बार",
-        "flashes_onset":
-        "यदि कभी-कभी/बार-बार, शुरू हुआ: *",
-        "shadow":
-        "दृष्टि में गहरी छाया/पर्दा/घूंघट (इस आंख में)? *",
-        "shadow_onset":
-        "यदि हाँ, कितने समय पहले? *",
-        "vision_decrease":
-        "दृष्टि में अचानक कमी (इस आंख में)? *",
-        "vision_onset":
-        "यदि हाँ, शुरुआत: *",
-        "pain":
-        "नई दोहरी दृष्टि या गंभीर आंख दर्द (इस आंख में)? *",
-        "onset_48h":
-        "48 घंटों के भीतर",
-        "onset_more_48h":
-        "48 घंटे से अधिक समय पहले",
-        "onset_24h":
-        "24 घंटों के भीतर",
-        "onset_more_24h":
-        "24 घंटे से अधिक समय पहले",
-        "section_e":
-        "📊 E) दृश्य कार्य और फॉलो-अप",
-        "vision_level":
-        "इस आंख में अनुमानित दृष्टि (सुधार के बिना): *",
-        "vision_2020":
-        "20/20 या बेहतर (0D)",
-        "vision_2030":
-        "20/30–20/60 (-0.5D से -1.5D)",
-        "vision_2080":
-        "20/80–20/200 (-2.0D से -4.0D)",
-        "vision_worse":
-        "20/200 से खराब (> -4.0D)",
-        "last_exam":
-        "अंतिम डायलेटेड आई परीक्षा की तारीख (यदि ज्ञात हो): *",
-        "exam_within_2":
-        "2 वर्षों के भीतर",
-        "exam_more_2":
-        "2 वर्ष से अधिक पहले",
-        "exam_never":
-        "कभी नहीं",
-        "section_f":
-        "🏋️ F) जीवनशैली / हाल के ट्रिगर्स",
-        "triggers":
-        "पिछले 3 महीनों में हाल के संभावित ट्रिगर्स (सभी लागू चुनें): *",
-        "trigger_trauma":
-        "सिर/आंख में भारी आघात",
-        "trigger_sports":
-        "संपर्क खेल",
-        "trigger_lifting":
-        "लक्षणों से ठीक पहले भारी उठाना/शारीरिक तनाव",
-        "trigger_none":
-        "कोई नहीं",
-        "calculate_btn":
-        "🔍 मेरे जोखिम मूल्यांकन की गणना करें",
-        "reset_btn":
-        "🔄 नया मूल्यांकन शुरू करें",
-        "missing_fields":
-        "⚠️ कृपया गणना करने से पहले सभी आवश्यक फ़ील्ड (*) भरें। गुम:",
-        "results_title":
-        "आपके जोखिम मूल्यांकन के परिणाम",
-        "disclaimer":
-        "**अस्वीकरण:** यह रेटिनल डिटैचमेंट जोखिम स्क्रीनर आपकी प्रतिक्रियाओं के आधार पर मार्गदर्शन प्रदान करता है कि आपको कितनी तत्काल नेत्र देखभाल मूल्यांकन लेनी चाहिए। यह निदान स्थापित नहीं करता है या नेत्र देखभाल पेशेवर द्वारा परीक्षा का स्थान नहीं लेता है। सिफारिशें सभी व्यक्तिगत चिकित्सा कारकों को ध्यान में नहीं रख सकती हैं। यदि आप नए या बिगड़ते लक्षणों का अनुभव कर रहे हैं, तो तुरंत किसी योग्य नेत्र विशेषज्ञ से संपर्क करें या आपातकालीन देखभाल लें।",
-        "risk_percentage":
-        "अनुमानित जोखिम प्रतिशत",
-        "risk_tier":
-        "जोखिम स्तर",
-        "very_high":
-        "बहुत उच्च",
-        "high":
-        "उच्च",
-        "moderate":
-        "मध्यम",
-        "low":
-        "कम",
-        "very_high_title":
-        "🚨 बहुत उच्च जोखिम - आपातकालीन कार्रवाई आवश्यक",
-        "very_high_msg":
-        "आप रेटिना डिटैचमेंट के बहुत उच्च जोखिम में हैं",
-        "very_high_action":
-        "⚠️ आज (उसी दिन) आपातकालीन नेत्र देखभाल प्राप्त करें",
-        "very_high_detail":
-        "आपके लक्षण और जोखिम कारक संभावित रेटिना डिटैचमेंट आपातकाल का संकेत देते हैं। तुरंत एक नेत्र रोग विशेषज्ञ से संपर्क करें या नेत्र विज्ञान सेवाओं वाले आपातकालीन कक्ष में जाएं। त्वरित उपचार स्थायी दृष्टि हानि को रोक सकता है।",
-        "high_title":
-        "⚠️ उच्च जोखिम - तत्काल मूल्यांकन आवश्यक",
-        "high_msg":
-        "आप रेटिना डिटैचमेंट के उच्च जोखिम में हैं",
-        "high_action":
-        "📞 तत्काल: 24 घंटों के भीतर मूल्यांकन निर्धारित करें",
-        "high_detail":
-        "तत्काल परीक्षा निर्धारित करने के लिए आज ही एक नेत्र देखभाल पेशेवर से संपर्क करें। आपके जोखिम कारक संभावित दृष्टि हानि को रोकने के लिए त्वरित ध्यान की मांग करते हैं।",
-        "moderate_title":
-        "ℹ️ मध्यम जोखिम - जल्द ही नियुक्ति निर्धारित करें",
-        "moderate_msg":
-        "आप रेटिना डिटैचमेंट के मध्यम जोखिम में हैं",
-        "moderate_action":
-        "📅 1–3 दिनों के भीतर आंखों की जांच निर्धारित करें",
-        "moderate_detail":
-        "हालांकि यह आपातकाल नहीं है, आपके लक्षण समय पर मूल्यांकन की आवश्यकता रखते हैं। नियुक्ति निर्धारित करने के लिए अपने नेत्र देखभाल प्रदाता से संपर्क करें। यदि लक्षण बिगड़ते हैं तो जल्द ही देखभाल प्राप्त करें।",
-        "low_title":
-        "✅ कम जोखिम - लक्षणों की निगरानी करें",
-        "low_msg":
-        "आप रेटिना डिटैचमेंट के कम जोखिम में हैं",
-        "low_action":
-        "👁️ अपने लक्षणों की निगरानी जारी रखें",
-        "low_detail":
-        "आपका वर्तमान जोखिम कम है। अपनी दृष्टि की निगरानी करें और यदि आप अचानक फ्लोटर्स, प्रकाश की चमक, या दृष्टि में परिवर्तन जैसे नए लक्षण विकसित करते हैं तो देखभाल प्राप्त करें। अपने नेत्र देखभाल प्रदाता द्वारा अनुशंसित नियमित नेत्र परीक्षाएं बनाए रखें।",
-        "important_note":
-        "💡 **महत्वपूर्ण**: यह स्क्रीनिंग उपकरण साक्ष्य-आधारित जोखिम कारकों के आधार पर नेत्र देखभाल की तात्कालिकता निर्धारित करने में मदद करता है। रेटिना डिटैचमेंट का शीघ्र पता लगाना और उपचार दृष्टि को संरक्षित कर सकता है और अंधेपन को रोक सकता है।"
-    }
-}
+"""
+with span("app.css"):
+    st.markdown(PAGE_CSS, unsafe_allow_html=True)
+
 
 
 # def calculate_percentage(points):
@@ -761,12 +427,163 @@ TRANSLATIONS = {
 
 
 
-def main():
+def collect_answers(v):
+    """Read the current answer codes from widget state."""
+    state = st.session_state
+    answers = {}
+    for question in QUESTIONS:
+        answers[question] = state.get(widget_key(question, answers, v))
+    return answers
+
+
+@st.fragment
+@timed("questionnaire_section")
+def questionnaire_section(section, t, v):
+    """Render one schema section; as a fragment it reruns on its own."""
+    st.markdown(f"## {t[section['title']]}")
+    columns = section["columns"]
+    containers = (st.columns(len(columns))
+                  if len(columns) > 1 else [st.container()])
+    answers = {}
+    for container, questions in zip(containers, columns):
+        with container:
+            for question in questions:
+                code = question["code"]
+                if "parent" in question and answers.get(
+                        question["parent"]) not in question["reveal"]:
+                    continue
+                key = widget_key(code, answers, v)
+                if question["widget"] == "number":
+                    answers[code] = st.number_input(
+                        t[code],
+                        min_value=question["min"],
+                        max_value=question["max"],
+                        value=None,
+                        step=1,
+                        placeholder=t[question["placeholder"]],
+                        key=key)
+                elif question["widget"] == "multiselect":
+                    answers[code] = st.multiselect(t[code],
+                                                   question["options"],
+                                                   format_func=t.get,
+                                                   key=key)
+                else:
+                    answers[code] = st.radio(t[code],
+                                             question["options"],
+                                             format_func=t.get,
+                                             index=None,
+                                             key=key)
+
+
+# Alert element and panel colours (background, border, heading, text)
+TIER_STYLES = {
+    "very_high": ("error", "#fee2e2", "#dc2626", "#991b1b", "#7f1d1d"),
+    "high": ("warning", "#fef3c7", "#f59e0b", "#92400e", "#78350f"),
+    "moderate": ("info", "#dbeafe", "#3b82f6", "#1e40af", "#1e3a8a"),
+    "low": ("success", "#d1fae5", "#10b981", "#065f46", "#064e3b"),
+}
+
+
+def render_panel(t, tier):
+    """Return (alert, heading, html) for one tier's results panel."""
+    alert, background, border, heading, text = TIER_STYLES[tier]
+    html = f"""
+<div style='background-color: {background}; padding: 1.5rem; border-radius: 8px; border-left: 5px solid {border};'>
+    <h4 style='color: {heading}; margin-top: 0;'>{t[tier + '_msg']}</h4>
+    <p style='color: {text}; font-size: 1.1rem; font-weight: 600;'>
+    {t[tier + '_action']}
+    </p>
+    <p style='color: {text};'>
+    {t[tier + '_detail']}
+    </p>
+</div>
+"""
+    return alert, f"### {t[tier + '_title']}", html
+
+
+# Results panels are rendered once per (language, tier) per process
+@st.cache_resource
+def get_result_panel(language, tier):
+    return render_panel(get_translations(language), tier)
+
+
+@timed("show_results")
+def show_results(language, points, emergency_override):
+    t = get_translations(language)
+    col1, col2 = st.columns([1, 1])
+    # with col1:
+    #     st.metric(t["risk_percentage"], f"{percentage:.1f}%")
+    tier = risk_tier(points, emergency_override)
+    with col1:
+        st.metric(t["risk_tier"], t[tier])
+
+    st.markdown("<br>", unsafe_allow_html=True)
+
+    # Risk Assessment and Recommendations
+    alert, heading, html = get_result_panel(language, tier)
+    getattr(st, alert)(heading)
+    st.markdown(html, unsafe_allow_html=True)
+
+    # Important Note
+    st.markdown("<br>", unsafe_allow_html=True)
+    st.info(t["important_note"])
+
+    # Reset button
+    st.markdown("<br>", unsafe_allow_html=True)
+    if st.button(t["reset_btn"],
+                 type="secondary",
+                 use_container_width=True):
+        # Set reset flag and rerun to clear form
+        st.session_state["reset_form"] = True
+        st.rerun()
+
+
+# Validation labels per language, stripped of their "*" markers once
+@st.cache_resource
+def get_field_labels(language):
+    return field_labels(get_translations(language))
+
+
+# Warn once per process if a catalog is missing keys that English has
+@st.cache_resource
+def check_translations():
+    return check_catalogs()
+
+
+# Optional warm-up (APP_WARM_UP=1): load every catalog and open the
+# storage in the background while the first page renders
+@st.cache_resource
+def start_warm_up():
+
+    def warm_up():
+        for language in LANGUAGES:
+            get_translations(language)
+        try:
+            get_storage()
+        except Exception as e:
+            pass
+
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    return True
+
+
+def setup():
+    if os.environ.get("APP_WARM_UP") == "1":
+        start_warm_up()
+    if os.environ.get("METRICS_PORT"):
+        try:
+            start_metrics_server()
+        except Exception as e:
+            pass
+
     # Track page view only once per session (not on every rerun)
     if "page_view_tracked" not in st.session_state:
         st.session_state.page_view_tracked = True
-        # increment_counter('page_views')
-        # send_view_notification()
+        increment_counter('page_views')
+        metrics.PAGE_VIEWS.inc()
+        send_view_notification()
+
+    check_translations()
 
     # Initialize form version for reset functionality
     if "form_version" not in st.session_state:
@@ -777,17 +594,17 @@ def main():
         st.session_state.form_version += 1
         st.session_state.reset_form = False
 
-    # Create a key prefix based on form version - this resets all widgets when version changes
-    v = st.session_state.form_version
 
+def header(v):
+    """Render the language selector, title and disclaimer."""
     # Language Selector
     col1, col2, col3 = st.columns([1, 1, 4])
     with col1:
-        language = st.selectbox("🌐", ["English", "Español", "हिंदी"],
+        language = st.selectbox("🌐", list(LANGUAGES),
                                 label_visibility="collapsed",
                                 key=f"language_select_{v}")
 
-    t = TRANSLATIONS[language]
+    t = get_translations(language)
 
     # Display user count at the top
     #user_count = get_counter('page_views')
@@ -801,419 +618,143 @@ def main():
     # Disclaimer at the beginning of the app
     st.warning(t["disclaimer"])
     st.markdown("<br>", unsafe_allow_html=True)
+    return language, t
 
-    points = 0
-    emergency_override = False
-
-    # Demographics Section
-    st.markdown(f"## {t['section_a']}")
-    col1, col2 = st.columns(2)
-    with col1:
-        age = st.number_input(t["age"],
-                              min_value=0,
-                              max_value=120,
-                              value=None,
-                              step=1,
-                              placeholder=t["age_placeholder"],
-                              key=f"age_{v}")
-        if age is not None:
-            if age >= 70:
-                points += 3
-            elif age >= 60:
-                points += 2
-            elif age >= 40:
-                points += 1
-    with col2:
-        sex = st.radio(t["sex"], [t["female"], t["male"]],
-                       index=None,
-                       key=f"sex_{v}")
-        if sex == t["male"]:
-            points += 1
 
-    # Eye History Section
-    st.markdown(f"## {t['section_b']}")
+def admin_dashboard():
+    st.markdown("---")
+    st.markdown("### Admin Dashboard")
 
     col1, col2 = st.columns(2)
     with col1:
-        prior_rd = st.radio(t["prior_rd"], [t["no"], t["yes"]],
-                            index=None,
-                            key=f"prior_rd_{v}")
-        if prior_rd == t["yes"]:
-            points += 5
-
-        cataract = st.radio(t["cataract"], [t["no"], t["yes"], t["not_sure"]],
-                            index=None,
-                            key=f"cataract_{v}")
-        if cataract == t["yes"]:
-            points += 2
-
-        yag = st.radio(t["yag"], [t["no"], t["yes"], t["not_sure"]],
-                       index=None,
-                       key=f"yag_{v}")
-        if yag == t["yes"]:
-            points += 2
-
+        page_views = get_counter('page_views')
+        st.metric("Total Page Views", page_views)
     with col2:
-        myopia = st.radio(t["myopia"], [t["no"], t["yes"]],
-                          index=None,
-                          key=f"myopia_{v}")
-        if myopia == t["yes"]:
-            myopia_level = st.radio(t["myopia_level"], [
-                t["myopia_none"], t["myopia_mild"], t["myopia_moderate"],
-                t["myopia_high"], t["dont_know"]
-            ],
-                                    index=None,
-                                    key=f"myopia_level_{v}")
-            if myopia_level == t["myopia_mild"]:
-                points += 1
-            elif myopia_level == t["myopia_moderate"]:
-                points += 2
-            elif myopia_level == t["myopia_high"]:
-                points += 4
-
-        retinal_condition = st.radio(t["retinal_condition"],
-                                     [t["no"], t["yes"], t["not_sure"]],
-                                     index=None,
-                                     key=f"retinal_condition_{v}")
-        if retinal_condition == t["yes"]:
-            points += 4
-
-        eye_trauma = st.radio(t["eye_trauma"], [t["no"], t["yes"]],
-                              index=None,
-                              key=f"eye_trauma_{v}")
-        if eye_trauma == t["yes"]:
-            points += 3
-
-    # Systemic/Family History Section
-    st.markdown(f"## {t['section_c']}")
-    col1, col2 = st.columns(2)
+        assessments = get_counter('assessments')
+        st.metric("Assessments Completed", assessments)
+
+    # Activity trends read only the pre-aggregated rollups
+    st.markdown("#### Activity")
+    try:
+        tab_hourly, tab_daily = st.tabs(["Last 48 Hours", "Last 30 Days"])
+        with tab_hourly:
+            st.bar_chart(load_rollups("hour", 2))
+        with tab_daily:
+            st.bar_chart(load_rollups("day", 30))
+    except Exception as e:
+        st.error(f"Could not load activity: {str(e)}")
+
+    # Anonymized results, aggregated from their daily rollups
+    st.markdown("#### Assessment Results")
+    try:
+        result_analytics()
+    except Exception as e:
+        st.error(f"Could not load assessment results: {str(e)}")
+
+    # Show detailed view log
+    st.markdown("#### View Log (for verification)")
+    auto_refresh = st.toggle("Auto-refresh", key="view_log_auto_refresh")
+    st.fragment(run_every=VIEW_LOG_REFRESH if auto_refresh else None)(
+        view_log_browser)()
+
+    try:
+        # Full log is exported on request to gzipped files served by
+        # the static file server, which streams them to the browser
+        if st.button("Prepare Full Log (CSV)", type="secondary"):
+            st.session_state.view_log_export = export_view_log()
+        if "view_log_export" in st.session_state:
+            parts = st.session_state.view_log_export
+            links = []
+            for part, name in enumerate(parts, 1):
+                label = "Download Full Log (CSV, gzip)"
+                if len(parts) > 1:
+                    label += f" part {part} of {len(parts)}"
+                links.append(f'<a href="app/static/exports/{name}" '
+                             f'download="view_log-{part}.csv.gz">{label}</a>')
+            st.markdown("<br>".join(links), unsafe_allow_html=True)
+            if len(parts) > 1:
+                st.caption("Concatenate the parts in order for one .csv.gz "
+                           "file.")
+    except Exception as e:
+        st.error(f"Could not export view log: {str(e)}")
+
+    cache = score_cache_info()
+    st.caption(f"Score cache: {cache.hits:,} hits, {cache.misses:,} misses, "
+               f"{cache.currsize:,}/{cache.maxsize:,} entries")
+
+    # Per-span timings from this process (APP_TIMING=1)
+    st.markdown("#### Timing")
+    if not timing.ENABLED:
+        st.caption("Timing is off. Start the app with APP_TIMING=1 to "
+                   "record spans.")
+        return
+    import pandas as pd
+    spans = timing.snapshot()
+    if spans:
+        st.dataframe(pd.DataFrame(spans).drop(columns="buckets"),
+                     use_container_width=True,
+                     hide_index=True)
+    else:
+        st.info("No spans recorded yet.")
+    col1, col2, col3 = st.columns([1, 1, 4])
     with col1:
-        diabetes = st.radio(t["diabetes"], [t["no"], t["yes"], t["not_sure"]],
-                            index=None,
-                            key=f"diabetes_{v}")
-        if diabetes == t["yes"]:
-            points += 1
+        if st.button("Dump Timings", type="secondary"):
+            st.session_state.timing_dump = timing.dump()
     with col2:
-        family_history = st.radio(t["family_history"],
-                                  [t["no"], t["yes"], t["not_sure"]],
-                                  index=None,
-                                  key=f"family_history_{v}")
-        if family_history == t["yes"]:
-            points += 3
+        st.button("Reset Timings", type="secondary", on_click=timing.reset)
+    if "timing_dump" in st.session_state:
+        st.caption(f"Saved to {st.session_state.timing_dump}")
 
-    # Current Symptoms Section
-    st.markdown(f"## {t['section_d']}")
 
-    col1, col2 = st.columns(2)
-    with col1:
-        floaters = st.radio(t["floaters"], [t["no"], t["yes"]],
-                            index=None,
-                            key=f"floaters_{v}")
-        if floaters == t["yes"]:
-            points += 3
-            floaters_onset = st.radio(t["floaters_onset"],
-                                      [t["onset_more_48h"], t["onset_48h"]],
-                                      key=f"floaters_onset_{v}",
-                                      index=None)
-            if floaters_onset == t["onset_48h"]:
-                points += 1
-
-        flashes = st.radio(t["flashes"], [
-            t["flashes_none"], t["flashes_occasional"], t["flashes_frequent"]
-        ],
-                           index=None,
-                           key=f"flashes_{v}")
-        if flashes == t["flashes_occasional"]:
-            points += 2
-            flashes_onset = st.radio(t["flashes_onset"],
-                                     [t["onset_more_48h"], t["onset_48h"]],
-                                     key=f"flashes_onset_{v}",
-                                     index=None)
-            if flashes_onset == t["onset_48h"]:
-                points += 1
-        elif flashes == t["flashes_frequent"]:
-            points += 3
-            flashes_onset = st.radio(t["flashes_onset"],
-                                     [t["onset_more_48h"], t["onset_48h"]],
-                                     key=f"flashes_onset2_{v}",
-                                     index=None)
-            if flashes_onset == t["onset_48h"]:
-                points += 1
-
-        shadow = st.radio(t["shadow"], [t["no"], t["yes"]],
-                          index=None,
-                          key=f"shadow_{v}")
-        if shadow == t["yes"]:
-            points += 8
-            shadow_onset = st.radio(t["shadow_onset"],
-                                    [t["onset_more_24h"], t["onset_24h"]],
-                                    key=f"shadow_onset_{v}",
-                                    index=None)
-            if shadow_onset == t["onset_24h"]:
-                points += 2
-                emergency_override = True
+@timed("main")
+def main():
+    with span("main.setup"):
+        setup()
+    v = st.session_state.form_version
 
-    with col2:
-        vision_decrease = st.radio(t["vision_decrease"], [t["no"], t["yes"]],
-                                   index=None,
-                                   key=f"vision_decrease_{v}")
-        if vision_decrease == t["yes"]:
-            points += 5
-            vision_onset = st.radio(t["vision_onset"],
-                                    [t["onset_more_24h"], t["onset_24h"]],
-                                    key=f"vision_onset_{v}",
-                                    index=None)
-            if vision_onset == t["onset_24h"]:
-                points += 2
-                emergency_override = True
-
-        pain = st.radio(t["pain"], [t["no"], t["yes"]],
-                        index=None,
-                        key=f"pain_{v}")
-        if pain == t["yes"]:
-            points += 1
-
-    # Visual Function Section
-    st.markdown(f"## {t['section_e']}")
-    col1, col2 = st.columns(2)
-    with col1:
-        vision_level = st.radio(t["vision_level"], [
-            t["vision_2020"], t["vision_2030"], t["vision_2080"],
-            t["vision_worse"], t["dont_know"]
-        ],
-                                index=None,
-                                key=f"vision_level_{v}")
-        if vision_level == t["vision_2030"]:
-            points += 1
-        elif vision_level == t["vision_2080"]:
-            points += 2
-        elif vision_level == t["vision_worse"]:
-            points += 3
-    with col2:
-        last_exam = st.radio(
-            t["last_exam"],
-            [t["exam_within_2"], t["exam_more_2"], t["exam_never"]],
-            index=None,
-            key=f"last_exam_{v}")
-        if last_exam == t["exam_more_2"]:
-            points += 1
-        elif last_exam == t["exam_never"]:
-            points += 2
-
-    # Lifestyle/Triggers Section
-    st.markdown(f"## {t['section_f']}")
-    recent_triggers = st.multiselect(t["triggers"], [
-        t["trigger_trauma"], t["trigger_sports"], t["trigger_lifting"],
-        t["trigger_none"], t["not_sure"]
-    ],
-                                     key=f"triggers_{v}")
-    if t["trigger_trauma"] in recent_triggers or t[
-            "trigger_sports"] in recent_triggers:
-        points += 3
-    if t["trigger_lifting"] in recent_triggers:
-        points += 1
+    with span("main.header"):
+        language, t = header(v)
+
+    # Each section is a fragment, so answering a question only reruns its
+    # own section; answers are read back from widget state on Calculate
+    with span("main.questionnaire"):
+        for section in SECTIONS:
+            questionnaire_section(section, t, v)
 
     # Calculate Button
     st.markdown("<br>", unsafe_allow_html=True)
 
-    # Validation
-    missing_fields = []
-    if age is None:
-        missing_fields.append(t["age"].replace(": *", ""))
-    if sex is None:
-        missing_fields.append(t["sex"].replace(": *", ""))
-    if prior_rd is None:
-        missing_fields.append(t["prior_rd"].replace("? *", ""))
-    if cataract is None:
-        missing_fields.append(t["cataract"].replace("? *", ""))
-    if yag is None:
-        missing_fields.append(t["yag"].replace("? *", ""))
-    if myopia is None:
-        missing_fields.append(t["myopia"].replace("? *", ""))
-    if myopia == t["yes"] and myopia_level is None:
-        missing_fields.append(t["myopia_level"].replace(": *", ""))
-    if retinal_condition is None:
-        missing_fields.append(t["retinal_condition"].replace("? *", ""))
-    if eye_trauma is None:
-        missing_fields.append(t["eye_trauma"].replace("? *", ""))
-    if diabetes is None:
-        missing_fields.append(t["diabetes"].replace("? *", ""))
-    if family_history is None:
-        missing_fields.append(t["family_history"].replace("? *", ""))
-    if floaters is None:
-        missing_fields.append(t["floaters"].replace("? *", ""))
-    if floaters == t["yes"] and floaters_onset is None:
-        missing_fields.append(t["floaters_onset"].replace(": *", ""))
-    if flashes is None:
-        missing_fields.append(t["flashes"].replace("? *", ""))
-    if flashes in [t["flashes_occasional"], t["flashes_frequent"]
-                   ] and flashes_onset is None:
-        missing_fields.append(t["flashes_onset"].replace(": *", ""))
-    if shadow is None:
-        missing_fields.append(t["shadow"].replace("? *", ""))
-    if shadow == t["yes"] and shadow_onset is None:
-        missing_fields.append(t["shadow_onset"].replace("? *", ""))
-    if vision_decrease is None:
-        missing_fields.append(t["vision_decrease"].replace("? *", ""))
-    if vision_decrease == t["yes"] and vision_onset is None:
-        missing_fields.append(t["vision_onset"].replace(": *", ""))
-    if pain is None:
-        missing_fields.append(t["pain"].replace("? *", ""))
-    if vision_level is None:
-        missing_fields.append(t["vision_level"].replace(": *", ""))
-    if last_exam is None:
-        missing_fields.append(t["last_exam"].replace(": *", ""))
-    if len(recent_triggers) == 0:
-        missing_fields.append(t["triggers"].replace(": *", ""))
-
-    @st.dialog(t["results_title"], width="large")
-    def show_results(points, emergency_override):
-        col1, col2 = st.columns([1, 1])
-        # with col1:
-        #     st.metric(t["risk_percentage"], f"{percentage:.1f}%")
-        with col1:
-            if emergency_override or points >= 15:
-                risk_tier = t["very_high"]
-            elif points >= 10:
-                risk_tier = t["high"]
-            elif points >= 5:
-                risk_tier = t["moderate"]
-            else:
-                risk_tier = t["low"]
-            st.metric(t["risk_tier"], risk_tier)
-
-        st.markdown("<br>", unsafe_allow_html=True)
-
-        # Risk Assessment and Recommendations
-        if emergency_override or points >= 15:
-            st.error(f"### {t['very_high_title']}")
-            st.markdown(f"""
-            <div style='background-color: #fee2e2; padding: 1.5rem; border-radius: 8px; border-left: 5px solid #dc2626;'>
-                <h4 style='color: #991b1b; margin-top: 0;'>{t['very_high_msg']}</h4>
-                <p style='color: #7f1d1d; font-size: 1.1rem; font-weight: 600;'>
-                {t['very_high_action']}
-                </p>
-                <p style='color: #7f1d1d;'>
-                {t['very_high_detail']}
-                </p>
-            </div>
-            """,
-                        unsafe_allow_html=True)
-        elif points >= 10:
-            st.warning(f"### {t['high_title']}")
-            st.markdown(f"""
-            <div style='background-color: #fef3c7; padding: 1.5rem; border-radius: 8px; border-left: 5px solid #f59e0b;'>
-                <h4 style='color: #92400e; margin-top: 0;'>{t['high_msg']}</h4>
-                <p style='color: #78350f; font-size: 1.1rem; font-weight: 600;'>
-                {t['high_action']}
-                </p>
-                <p style='color: #78350f;'>
-                {t['high_detail']}
-                </p>
-            </div>
-            """,
-                        unsafe_allow_html=True)
-        elif points >= 5:
-            st.info(f"### {t['moderate_title']}")
-            st.markdown(f"""
-            <div style='background-color: #dbeafe; padding: 1.5rem; border-radius: 8px; border-left: 5px solid #3b82f6;'>
-                <h4 style='color: #1e40af; margin-top: 0;'>{t['moderate_msg']} </h4>
-                <p style='color: #1e3a8a; font-size: 1.1rem; font-weight: 600;'>
-                {t['moderate_action']}
-                </p>
-                <p style='color: #1e3a8a;'>
-                {t['moderate_detail']}
-                </p>
-            </div>
-            """,
-                        unsafe_allow_html=True)
-        else:
-            st.success(f"### {t['low_title']}")
-            st.markdown(f"""
-            <div style='background-color: #d1fae5; padding: 1.5rem; border-radius: 8px; border-left: 5px solid #10b981;'>
-                <h4 style='color: #065f46; margin-top: 0;'>{t['low_msg']} </h4>
-                <p style='color: #064e3b; font-size: 1.1rem; font-weight: 600;'>
-                {t['low_action']}
-                </p>
-                <p style='color: #064e3b;'>
-                {t['low_detail']}
-                </p>
-            </div>
-            """,
-                        unsafe_allow_html=True)
-
-        # Important Note
-        st.markdown("<br>", unsafe_allow_html=True)
-        st.info(t["important_note"])
-
-        # Reset button
-        st.markdown("<br>", unsafe_allow_html=True)
-        if st.button(t["reset_btn"],
-                     type="secondary",
-                     use_container_width=True):
-            # Set reset flag and rerun to clear form
-            st.session_state["reset_form"] = True
-            st.rerun()
-
     if st.button(t["calculate_btn"], type="primary"):
+        with span("main.validation"):
+            answers = collect_answers(v)
+            missing_fields = [
+                get_field_labels(language)[question]
+                for question in missing_answers(answers)
+            ]
         if missing_fields:
             st.error(f"{t['missing_fields']} {', '.join(missing_fields)}")
         else:
             # Increment the assessment counter
-            # increment_counter()
+            increment_counter()
+            with span("main.scoring"):
+                # Memoized on the normalized answers; panels are cached
+                # per (language, tier), so repeats skip both
+                points, emergency_override, tier = score_cached(answers)
+            metrics.ASSESSMENTS.inc(tier=tier)
+            if emergency_override:
+                metrics.EMERGENCY_OVERRIDES.inc()
+            record_result(answers, points, emergency_override, tier,
+                          language)
             # percentage = calculate_percentage(points)
-            show_results(points, emergency_override)
+            results_dialog = st.dialog(t["results_title"],
+                                       width="large")(show_results)
+            results_dialog(language, points, emergency_override)
 
     # Hidden admin view - only accessible via URL parameter ?admin=retina2024
     query_params = st.query_params
     if query_params.get("admin") == "retina2024":
-        st.markdown("---")
-        st.markdown("### Admin Dashboard")
-
-        col1, col2 = st.columns(2)
-        with col1:
-            # page_views = get_counter('page_views')
-            st.metric("Total Page Views", page_views)
-        with col2:
-            # assessments = get_counter('assessments')
-            st.metric("Assessments Completed", assessments)
-
-        # Show detailed view log
-        st.markdown("#### View Log (for verification)")
-        try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT view_type, timestamp 
-                FROM view_log 
-                ORDER BY timestamp DESC 
-                LIMIT 50
-            """)
-            logs = cur.fetchall()
-            cur.close()
-            conn.close()
-
-            if logs:
-                import pandas as pd
-                df = pd.DataFrame(logs, columns=["Type", "Timestamp"])
-                st.dataframe(df, use_container_width=True)
-
-                # Download button for full log
-                cur = get_db_connection().cursor()
-                cur.execute(
-                    "SELECT view_type, timestamp FROM view_log ORDER BY timestamp DESC"
-                )
-                all_logs = cur.fetchall()
-                csv_data = "Type,Timestamp\n" + "\n".join(
-                    [f"{log[0]},{log[1]}" for log in all_logs])
-                st.download_button(label="Download Full Log (CSV)",
-                                   data=csv_data,
-                                   file_name="view_log.csv",
-                                   mime="text/csv")
-            else:
-                st.info("No views recorded yet.")
-        except Exception as e:
-            st.error(f"Could not load view log: {str(e)}")
+        with span("main.admin"):
+            admin_dashboard()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+"""Vectorized scoring of many questionnaires at once.
+
+Columns are keyed by question code. Single-choice answers are stored as
+integer codes (the index of the option in questionnaire.OPTIONS, -1 when
+unanswered), triggers as a bitmask over OPTIONS["triggers"], and age as a
+float with NaN for unanswered. String code columns are encoded on the way
+in, so a DataFrame read straight from an export can be scored as-is.
+
+All lookup tables are built from the rule tables in questionnaire.py, so
+the batch path agrees exactly with score_assessment().
+"""
+from numbers import Real
+
+import numpy as np
+import pandas as pd
+
+from questionnaire import (AGE_BANDS, ANSWER_POINTS, CHOICE_QUESTIONS,
+                           EMERGENCY_ANSWERS, FOLLOW_UPS, OPTIONS,
+                           TRIGGER_POINTS)
+from scoring import TIER_THRESHOLDS, TIERS
+
+# Separator for multiple triggers in a single text cell
+TRIGGER_SEPARATOR = "|"
+
+
+def _option_table(question, values, dtype):
+    # One slot per option plus a trailing slot, so code -1 (unanswered)
+    # indexes the trailing default without a separate mask
+    table = np.zeros(len(OPTIONS[question]) + 1, dtype=dtype)
+    for i, option in enumerate(OPTIONS[question]):
+        table[i] = values.get(option, 0)
+    return table
+
+
+POINT_TABLES = {
+    question: _option_table(question, ANSWER_POINTS.get(question, {}),
+                            np.int16)
+    for question in CHOICE_QUESTIONS
+}
+
+REVEAL_TABLES = {
+    question: _option_table(parent, dict.fromkeys(reveal, True), np.bool_)
+    for question, (parent, reveal) in FOLLOW_UPS.items()
+}
+
+EMERGENCY_TABLES = {
+    question: _option_table(question, {answer: True}, np.bool_)
+    for question, answer in EMERGENCY_ANSWERS.items()
+}
+
+TRIGGER_MASKS = tuple(
+    (sum(1 << OPTIONS["triggers"].index(trigger) for trigger in group), pts)
+    for group, pts in TRIGGER_POINTS)
+
+TIER_CODES = {tier: code for code, tier in enumerate(TIERS)}
+
+
+# Integer codes, as numbers or text, are categories after the option codes;
+# the tables map each category back to its option (and code -1 to -1)
+CODE_CATEGORIES = {
+    question: [*OPTIONS[question], *range(len(OPTIONS[question])),
+               *map(str, range(len(OPTIONS[question])))]
+    for question in CHOICE_QUESTIONS
+}
+
+CODE_TABLES = {
+    question: np.array([*range(len(OPTIONS[question]))] * 3 + [-1],
+                       dtype=np.int8)
+    for question in CHOICE_QUESTIONS
+}
+
+
+def encode_column(question, values):
+    """Convert a column of option codes to integer codes (-1 = unanswered).
+
+    Numbers, in numeric columns or as text, are taken as integer codes
+    already; codes outside the question's options count as unanswered.
+    """
+    values = pd.Series(values, copy=False)
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        codes = values.fillna(-1).to_numpy()
+        valid = (codes >= 0) & (codes < len(OPTIONS[question]))
+        return np.where(valid, codes, -1).astype(np.int8)
+    return CODE_TABLES[question][
+        pd.Categorical(values, categories=CODE_CATEGORIES[question]).codes]
+
+
+TRIGGER_BITS = {
+    trigger: 1 << bit
+    for bit, trigger in enumerate(OPTIONS["triggers"])
+}
+
+
+def _trigger_mask(cell):
+    if isinstance(cell, str) and cell.isdigit():
+        cell = int(cell)
+    if isinstance(cell, Real):
+        # An encoded mask, range-checked like a numeric column
+        return int(cell) if 0 <= cell < 1 << len(OPTIONS["triggers"]) else 0
+    if isinstance(cell, str):
+        cell = cell.split(TRIGGER_SEPARATOR)
+    mask = 0
+    for trigger in cell:
+        mask |= TRIGGER_BITS.get(trigger, 0)
+    return mask
+
+
+def encode_triggers(values):
+    """Convert a column of trigger selections to a bitmask array.
+
+    Each cell may be a list of trigger codes, a TRIGGER_SEPARATOR-joined
+    string of codes, or an already-encoded integer mask. Unknown codes
+    are ignored. Cells are factorized first, so each distinct selection
+    is parsed once however many rows share it.
+    """
+    values = pd.Series(values, copy=False)
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        masks = values.fillna(0).to_numpy()
+        valid = (masks >= 0) & (masks < 1 << len(OPTIONS["triggers"]))
+        return np.where(valid, masks, 0).astype(np.uint8)
+    if pd.api.types.infer_dtype(values, skipna=True) not in ("string",
+                                                               "empty"):
+        values = values.map(lambda cell: tuple(cell)
+                            if isinstance(cell, (list, np.ndarray)) else cell)
+    codes, selections = pd.factorize(values)
+    # Trailing 0 for code -1 (missing cells), as in _option_table()
+    table = np.array([*map(_trigger_mask, selections), 0], dtype=np.uint8)
+    return table[codes]
+
+
+def encode_answers(data):
+    """Encode a DataFrame or mapping of answer columns for score_batch().
+
+    Returns the encoded columns and the number of rows.
+    """
+    columns = {}
+    if "age" in data:
+        columns["age"] = pd.to_numeric(pd.Series(data["age"], copy=False),
+                                       errors="coerce").to_numpy(np.float64)
+    for question in CHOICE_QUESTIONS:
+        if question in data:
+            columns[question] = encode_column(question, data[question])
+    if "triggers" in data:
+        columns["triggers"] = encode_triggers(data["triggers"])
+    if isinstance(data, pd.DataFrame):
+        n = len(data)
+    else:
+        n = len(next(iter(data.values()))) if data else 0
+    return columns, n
+
+
+def score_batch(data):
+    """Score every row of a DataFrame or mapping of answer columns.
+
+    Returns (points, emergency_override, tier) arrays, where tier holds
+    indexes into scoring.TIERS. Missing columns count as unanswered.
+    """
+    columns, n = encode_answers(data)
+    unanswered = np.full(n, -1, dtype=np.int8)
+    codes = {q: columns.get(q, unanswered) for q in CHOICE_QUESTIONS}
+
+    age = columns.get("age")
+    if age is None:
+        points = np.zeros(n, dtype=np.int16)
+    else:
+        # NaN compares False against every band and scores 0
+        points = np.select([age >= min_age for min_age, _ in AGE_BANDS],
+                           [pts for _, pts in AGE_BANDS],
+                           0).astype(np.int16)
+    emergency_override = np.zeros(n, dtype=np.bool_)
+
+    for question in ANSWER_POINTS:
+        answered = codes[question]
+        question_points = POINT_TABLES[question][answered]
+        shown = True
+        if question in FOLLOW_UPS:
+            shown = REVEAL_TABLES[question][codes[FOLLOW_UPS[question][0]]]
+            question_points = np.where(shown, question_points, 0)
+        if question in EMERGENCY_TABLES:
+            emergency_override |= shown & EMERGENCY_TABLES[question][answered]
+        points += question_points
+
+    triggers = columns.get("triggers")
+    if triggers is not None:
+        for mask, pts in TRIGGER_MASKS:
+            points += np.where(triggers & mask, pts, 0).astype(np.int16)
+
+    tier = np.zeros(n, dtype=np.int8)
+    for min_points, tier_name in TIER_THRESHOLDS:
+        tier = np.where((tier == 0) & (points >= min_points),
+                        TIER_CODES[tier_name], tier).astype(np.int8)
+    tier[emergency_override] = TIER_CODES["very_high"]
+
+    return points, emergency_override, tier
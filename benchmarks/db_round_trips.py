@@ -0,0 +1,142 @@
+"""Database round trips and write latency per assessment.
+
+    python benchmarks/db_round_trips.py --database-url postgresql://localhost/bench
+    python benchmarks/db_round_trips.py --assessments 2000 --output run.json
+
+Each assessment records a page view, an assessment and its anonymized
+result through the telemetry writer, as app.py does. Round trips are
+counted by the pool's connections (the retina_db_round_trips_total
+metric), for three flush patterns:
+
+    per_event       a flush after every event (an idle app)
+    per_assessment  a flush after each assessment's two events
+    batched         a flush every 100 assessments (a busy app)
+
+The counter read behind the admin page and notification digests is
+measured the same way. Needs a Postgres database; `python main.py
+init-db` is run against it first.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from common import RESULTS_DIR, ROOT, git_commit
+
+sys.path.insert(0, ROOT)
+
+from metrics import DB_ROUND_TRIPS  # noqa: E402
+from results import encode_result  # noqa: E402
+from storage import is_sqlite, open_storage  # noqa: E402
+from telemetry import TelemetryWriter  # noqa: E402
+
+# Events recorded between flushes, by pattern
+PATTERNS = {
+    "per_event": 1,
+    "per_assessment": 2,
+    "batched": 200,
+}
+
+
+def measure_writes(storage, assessments, events_per_flush, spool_path):
+    writer = TelemetryWriter(lambda: storage, spool_path=spool_path)
+    # Prepare statements and run upkeep before counting
+    writer.record("page_views")
+    writer.flush()
+    times = []
+    before = DB_ROUND_TRIPS.value()
+    for i in range(assessments * 2):
+        if i % 2 == 0:
+            writer.record("page_views")
+        else:
+            writer.record("assessments")
+            writer.record_result(
+                encode_result({"sex": "female"}, 0, False, "low", "English"))
+        if (i + 1) % events_per_flush == 0:
+            start = time.perf_counter()
+            writer.flush()
+            times.append(time.perf_counter() - start)
+    writer.flush()
+    trips = DB_ROUND_TRIPS.value() - before
+    if writer.spooled_events():
+        sys.exit("Writes failed and were spooled; is the database up?")
+    return {
+        "flushes": len(times),
+        "round_trips": trips,
+        "round_trips_per_assessment": round(trips / assessments, 3),
+        "flush_p50_ms": round(statistics.median(times) * 1000, 3),
+        "flush_max_ms": round(max(times) * 1000, 3),
+    }
+
+
+def measure_reads(storage, reads):
+    storage.get_counter("page_views")
+    times = []
+    before = DB_ROUND_TRIPS.value()
+    for _ in range(reads):
+        start = time.perf_counter()
+        storage.get_counter("page_views")
+        times.append(time.perf_counter() - start)
+    return {
+        "round_trips_per_read": round((DB_ROUND_TRIPS.value() - before) /
+                                      reads, 3),
+        "read_p50_ms": round(statistics.median(times) * 1000, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assessments", type=int, default=500)
+    parser.add_argument("--database-url",
+                        default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--output", help="JSON results file")
+    args = parser.parse_args(argv)
+
+    if not args.database_url or is_sqlite(args.database_url):
+        sys.exit("A Postgres --database-url (or DATABASE_URL) is required")
+    os.environ["DATABASE_URL"] = args.database_url
+    subprocess.run([sys.executable, "main.py", "init-db"],
+                   cwd=ROOT,
+                   check=True)
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "assessments": args.assessments,
+        "patterns": {},
+    }
+    storage = open_storage(args.database_url, maxconn=1)
+    spool_path = os.path.join(RESULTS_DIR, "db_round_trips.spool")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    try:
+        for name, events_per_flush in PATTERNS.items():
+            stats = measure_writes(storage, args.assessments,
+                                   events_per_flush, spool_path)
+            results["patterns"][name] = stats
+            print(f"{name:<16} {stats['round_trips_per_assessment']:>7} "
+                  f"round trips/assessment  "
+                  f"flush p50 {stats['flush_p50_ms']:>7.2f} ms")
+        results["get_counter"] = measure_reads(storage, args.assessments)
+        print(f"{'get_counter':<16} "
+              f"{results['get_counter']['round_trips_per_read']:>7} "
+              f"round trips/read        "
+              f"read p50 {results['get_counter']['read_p50_ms']:>8.2f} ms")
+    finally:
+        storage.close()
+
+    output = args.output or os.path.join(RESULTS_DIR,
+                                         f"db_round_trips-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    print(f"Saved {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""Rerun-latency benchmark for app.py, driven through Streamlit's AppTest.
+
+    python benchmarks/rerun_latency.py
+    python benchmarks/rerun_latency.py --iterations 50 --compare old.json
+    python benchmarks/rerun_latency.py --database-url postgresql://localhost/bench
+    python benchmarks/rerun_latency.py --database-url sqlite:///bench.db
+
+Each scenario puts the app in a representative state and times the rerun
+that follows. Times are taken without tracing; allocations come from a
+second, shorter pass under tracemalloc. Results are written as JSON keyed
+by scenario, tagged with the current git commit, so runs can be compared.
+
+The admin scenario needs a database and only runs when --database-url or
+DATABASE_URL is set: a local throwaway Postgres, or sqlite:///bench.db to
+run fully offline. `python main.py init-db` is run against it first.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from common import RESULTS_DIR, ROOT, git_commit
+
+sys.path.insert(0, ROOT)
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from questionnaire import QUESTION_SPECS, widget_key  # noqa: E402
+
+APP = os.path.join(ROOT, "app.py")
+
+LOW_RISK = {
+    "age": 30,
+    "sex": "female",
+    "prior_rd": "no",
+    "cataract": "no",
+    "yag": "no",
+    "myopia": "no",
+    "retinal_condition": "no",
+    "eye_trauma": "no",
+    "diabetes": "no",
+    "family_history": "no",
+    "floaters": "no",
+    "flashes": "flashes_none",
+    "shadow": "no",
+    "vision_decrease": "no",
+    "pain": "no",
+    "vision_level": "vision_2020",
+    "last_exam": "exam_within_2",
+    "triggers": ["trigger_none"],
+}
+
+VERY_HIGH_RISK = {
+    "age": 75,
+    "sex": "male",
+    "prior_rd": "yes",
+    "cataract": "yes",
+    "yag": "yes",
+    "myopia": "yes",
+    "myopia_level": "myopia_high",
+    "retinal_condition": "yes",
+    "eye_trauma": "yes",
+    "diabetes": "yes",
+    "family_history": "yes",
+    "floaters": "yes",
+    "floaters_onset": "onset_48h",
+    "flashes": "flashes_frequent",
+    "flashes_onset": "onset_48h",
+    "shadow": "yes",
+    "shadow_onset": "onset_24h",
+    "vision_decrease": "yes",
+    "vision_onset": "onset_24h",
+    "pain": "yes",
+    "vision_level": "vision_worse",
+    "last_exam": "exam_never",
+    "triggers": ["trigger_trauma", "trigger_lifting"],
+}
+
+
+def new_app(admin=False):
+    at = AppTest.from_file(APP, default_timeout=60)
+    if admin:
+        at.query_params["admin"] = "retina2024"
+    return at.run()
+
+
+def fill(at, answers):
+    """Answer the form, revealing follow-ups as their parents are set."""
+    v = at.session_state["form_version"]
+    given = {}
+    for question in QUESTION_SPECS:
+        code = question["code"]
+        if code not in answers:
+            continue
+        if "parent" in question and given.get(
+                question["parent"]) not in question["reveal"]:
+            continue
+        key = widget_key(code, given, v)
+        if question["widget"] == "number":
+            at.number_input(key=key).set_value(answers[code])
+        elif question["widget"] == "multiselect":
+            at.multiselect(key=key).set_value(answers[code])
+        else:
+            at.radio(key=key).set_value(answers[code])
+        given[code] = answers[code]
+        at.run()
+    return at
+
+
+def click(at, label):
+    next(button for button in at.button if button.label == label).click()
+    return at
+
+
+def calculate_label(at):
+    return at.button[0].label
+
+
+def scenario_empty_form():
+    at = new_app()
+    return lambda: at.run()
+
+
+def scenario_low_risk():
+    at = fill(new_app(), LOW_RISK)
+    return lambda: at.run()
+
+
+def scenario_very_high_risk():
+    at = fill(new_app(), VERY_HIGH_RISK)
+    return lambda: at.run()
+
+
+def scenario_calculate():
+    at = fill(new_app(), VERY_HIGH_RISK)
+    label = calculate_label(at)
+    return lambda: click(at, label).run()
+
+
+def scenario_language_switch():
+    at = new_app()
+    languages = list(at.selectbox[0].options)
+    state = {"next": 1}
+
+    def step():
+        at.selectbox[0].set_value(languages[state["next"] % len(languages)])
+        state["next"] += 1
+        at.run()
+
+    return step
+
+
+def scenario_reset():
+    at = new_app()
+
+    def prepare():
+        fill(at, LOW_RISK)
+        click(at, calculate_label(at)).run()
+
+    def step():
+        reset_label = next(button.label for button in at.button
+                           if button.label != calculate_label(at))
+        click(at, reset_label).run()
+
+    return step, prepare
+
+
+def scenario_admin():
+    at = new_app(admin=True)
+    return lambda: at.run()
+
+
+SCENARIOS = {
+    "empty_form": scenario_empty_form,
+    "low_risk_answered": scenario_low_risk,
+    "very_high_risk_answered": scenario_very_high_risk,
+    "calculate_very_high": scenario_calculate,
+    "language_switch": scenario_language_switch,
+    "reset_form": scenario_reset,
+    "admin_view": scenario_admin,
+}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, round(pct / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def measure(setup, iterations, alloc_iterations, warmup=2):
+    step = setup()
+    prepare = None
+    if isinstance(step, tuple):
+        step, prepare = step
+
+    def run_once():
+        if prepare:
+            prepare()
+        start = time.perf_counter()
+        step()
+        return time.perf_counter() - start
+
+    for _ in range(warmup):
+        run_once()
+    times = [run_once() for _ in range(iterations)]
+
+    allocated, peaks = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_iterations):
+            if prepare:
+                prepare()
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            step()
+            after, peak = tracemalloc.get_traced_memory()
+            allocated.append(after - before)
+            peaks.append(peak - before)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "p50_ms": round(statistics.median(times) * 1000, 3),
+        "p95_ms": round(percentile(times, 95) * 1000, 3),
+        "mean_ms": round(statistics.fmean(times) * 1000, 3),
+        "max_ms": round(max(times) * 1000, 3),
+        "alloc_net_kib": round(statistics.median(allocated) / 1024, 1),
+        "alloc_peak_kib": round(statistics.median(peaks) / 1024, 1),
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline.get('commit')})")
+    for name, stats in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        for metric in ("p50_ms", "p95_ms", "alloc_peak_kib"):
+            change = (stats[metric] - old[metric]) / old[metric] * 100 \
+                if old[metric] else 0.0
+            print(f"  {name:<26} {metric:<15} {old[metric]:>10} -> "
+                  f"{stats[metric]:>10} ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--alloc-iterations", type=int, default=5)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS,
+                        default=list(SCENARIOS))
+    parser.add_argument("--database-url",
+                        default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--output", help="JSON results file")
+    parser.add_argument("--compare", help="earlier JSON results to diff")
+    args = parser.parse_args(argv)
+
+    # Telemetry has nowhere to go without a database; keep its errors quiet
+    logging.getLogger("telemetry").setLevel(logging.CRITICAL)
+    scenarios = list(args.scenarios)
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+        subprocess.run([sys.executable, "main.py", "init-db"],
+                       cwd=ROOT,
+                       check=True)
+    else:
+        os.environ.pop("DATABASE_URL", None)
+        if "admin_view" in scenarios:
+            scenarios.remove("admin_view")
+            print("Skipping admin_view: no --database-url", file=sys.stderr)
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "streamlit": __import__("streamlit").__version__,
+        "scenarios": {},
+    }
+    for name in scenarios:
+        stats = measure(SCENARIOS[name], args.iterations,
+                        args.alloc_iterations)
+        results["scenarios"][name] = stats
+        print(f"{name:<26} p50 {stats['p50_ms']:>8.1f} ms  "
+              f"p95 {stats['p95_ms']:>8.1f} ms  "
+              f"peak {stats['alloc_peak_kib']:>8.1f} KiB")
+
+    output = args.output or os.path.join(RESULTS_DIR,
+                                         f"rerun_latency-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    print(f"Saved {output}", file=sys.stderr)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
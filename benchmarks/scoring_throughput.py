@@ -0,0 +1,236 @@
+"""Microbenchmark for the risk scoring rules.
+
+    python benchmarks/scoring_throughput.py
+    python benchmarks/scoring_throughput.py --rows 1000000 --output run.json
+
+Synthetic assessments are drawn from the whole answer space (every option
+of every question, unanswered questions, follow-ups only where their
+parent reveals them, any mix of triggers). The harness measures:
+
+    single   score_assessment() latency per call
+    batch    score_batch() throughput on option-code columns, as read
+             from an export
+    encoded  score_batch() throughput on pre-encoded integer columns
+    memory   tracemalloc peak per assessment for each path
+
+A sample of the batch results is checked against score_assessment()
+first. The run exits non-zero if any rate falls below, or memory rises
+above, the limits in the baseline file (benchmarks/scoring_baseline.json
+unless --baseline is given). No database or Streamlit is needed.
+
+The default baseline is the median of five runs on one core of an Intel
+Xeon VM under Python 3.11, numpy 2.3 and pandas 2.3 (single 77k calls/s,
+batch 584k rows/s, encoded 3.4M rows/s), less 30% for run-to-run noise;
+memory limits are the measured bytes plus about 25%. Slower machines
+should pass their own --baseline.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from batch_scoring import (TRIGGER_SEPARATOR, encode_answers,  # noqa: E402
+                           score_batch)
+from questionnaire import QUESTION_SPECS  # noqa: E402
+from scoring import FOLLOW_UPS, TIERS, score_assessment  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "scoring_baseline.json")
+
+# Share of questions left unanswered in synthetic assessments
+UNANSWERED_RATE = 0.05
+
+
+def synthetic_frame(n, seed=0):
+    """Return n random assessments covering the full answer space.
+
+    Columns hold option codes as in an export read by main.py: None for
+    unanswered, triggers joined with TRIGGER_SEPARATOR.
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for question in QUESTION_SPECS:
+        code = question["code"]
+        unanswered = rng.random(n) < UNANSWERED_RATE
+        if question["widget"] == "number":
+            values = rng.integers(question["min"], question["max"] + 1,
+                                  n).astype(object)
+        elif question["widget"] == "multiselect":
+            options = np.asarray(question["options"], dtype=object)
+            chosen = rng.random((n, len(options))) < 0.3
+            values = np.array([TRIGGER_SEPARATOR.join(options[row])
+                               for row in chosen], dtype=object)
+        else:
+            options = np.asarray(question["options"], dtype=object)
+            values = options[rng.integers(0, len(options), n)]
+        if code in FOLLOW_UPS:
+            parent, reveal = FOLLOW_UPS[code]
+            unanswered |= ~np.isin(columns[parent], reveal)
+        values[unanswered] = None
+        columns[code] = values
+    return pd.DataFrame(columns)
+
+
+def to_answers(frame):
+    """Convert export rows back to the answer dicts used by the app."""
+    assessments = []
+    for row in frame.to_dict("records"):
+        answers = {q: a for q, a in row.items() if a is not None}
+        if "triggers" in answers:
+            answers["triggers"] = answers["triggers"].split(
+                TRIGGER_SEPARATOR) if answers["triggers"] else []
+        assessments.append(answers)
+    return assessments
+
+
+def check_agreement(assessments, frame):
+    points, emergency_override, tier = score_batch(frame)
+    for i, answers in enumerate(assessments):
+        expected = score_assessment(answers)
+        got = (int(points[i]), bool(emergency_override[i]), TIERS[tier[i]])
+        if got != expected:
+            raise SystemExit(f"Batch and single scoring disagree on row {i}: "
+                             f"{got} != {expected} for {answers}")
+
+
+def bench_single(assessments, repeat):
+    times = []
+    for _ in range(repeat):
+        for answers in assessments:
+            start = time.perf_counter_ns()
+            score_assessment(answers)
+            times.append(time.perf_counter_ns() - start)
+    total = sum(times) / 1e9
+    times.sort()
+    return {
+        "calls": len(times),
+        "p50_us": round(statistics.median(times) / 1000, 3),
+        "p95_us": round(times[int(0.95 * (len(times) - 1))] / 1000, 3),
+        "calls_per_sec": round(len(times) / total),
+    }
+
+
+def bench_batch(data, n, repeat):
+    score_batch(data)
+    best = min(_timed(score_batch, data) for _ in range(repeat))
+    return {
+        "rows": n,
+        "seconds": round(best, 4),
+        "rows_per_sec": round(n / best),
+    }
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def peak_bytes(func, *args):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - before
+
+
+def run(rows, single_rows, repeat, seed):
+    frame = synthetic_frame(rows, seed)
+    encoded, n = encode_answers(frame)
+    assessments = to_answers(frame.iloc[:single_rows])
+    check_agreement(assessments, frame.iloc[:single_rows])
+
+    single = bench_single(assessments, repeat)
+    single["bytes_per_assessment"] = max(
+        peak_bytes(score_assessment, answers)
+        for answers in assessments[:100])
+
+    batch = bench_batch(frame, n, repeat)
+    batch["bytes_per_assessment"] = round(
+        peak_bytes(score_batch, frame) / n, 1)
+
+    encoded_batch = bench_batch(encoded, n, repeat)
+    encoded_batch["bytes_per_assessment"] = round(
+        peak_bytes(score_batch, encoded) / n, 1)
+
+    return {
+        "rows": rows,
+        "seed": seed,
+        "single": single,
+        "batch": batch,
+        "encoded": encoded_batch,
+    }
+
+
+def check_baseline(results, baseline):
+    """Return a list of failures against the baseline limits."""
+    failures = []
+    for path, limits in baseline.items():
+        stats = results.get(path, {})
+        minimum = limits.get("min_per_sec")
+        rate = stats.get("calls_per_sec", stats.get("rows_per_sec"))
+        if minimum is not None and rate < minimum:
+            failures.append(f"{path}: {rate:,}/s is below the baseline "
+                            f"{minimum:,}/s")
+        maximum = limits.get("max_bytes_per_assessment")
+        used = stats.get("bytes_per_assessment")
+        if maximum is not None and used > maximum:
+            failures.append(f"{path}: {used:,} bytes per assessment is above "
+                            f"the baseline {maximum:,}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000,
+                        help="synthetic assessments for the batch paths")
+    parser.add_argument("--single-rows", type=int, default=20_000,
+                        help="assessments timed one call at a time")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--output", help="also save results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, min(args.single_rows, args.rows), args.repeat,
+                  args.seed)
+    single, batch, encoded = (results["single"], results["batch"],
+                              results["encoded"])
+    print(f"single   p50 {single['p50_us']:>8.2f} us  "
+          f"p95 {single['p95_us']:>8.2f} us  "
+          f"{single['calls_per_sec']:>12,} calls/s  "
+          f"{single['bytes_per_assessment']:>8,} B/assessment")
+    for name, stats in (("batch", batch), ("encoded", encoded)):
+        print(f"{name:<8} {stats['rows']:,} rows in {stats['seconds']:.3f} s"
+              f"  {stats['rows_per_sec']:>12,} rows/s  "
+              f"{stats['bytes_per_assessment']:>8,} B/assessment")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            failures = check_baseline(results, json.load(f))
+        for failure in failures:
+            print(f"FAIL {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+        print(f"Within baseline {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
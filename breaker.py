@@ -0,0 +1,52 @@
+"""Circuit breaker for calls to a backend that may be down or slow.
+
+After failure_threshold consecutive failures the breaker opens and calls
+fail immediately with CircuitOpenError. Once reset_timeout seconds have
+passed, a single trial call is let through (half-open): success closes
+the breaker, failure opens it again for another reset_timeout.
+"""
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend while its breaker is open."""
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if (self._trial_running or
+                    time.monotonic() - self.opened_at < self.reset_timeout):
+                raise CircuitOpenError(f"{self.name} is unavailable")
+            self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
@@ -0,0 +1,823 @@
+"""Postgres storage backend shared by the app and the command line tools."""
+import gzip
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2 import pool as pg_pool
+from psycopg2 import sql
+
+from breaker import CircuitBreaker, CircuitOpenError
+from metrics import DB_ROUND_TRIPS
+from questionnaire import CHOICE_QUESTIONS, OPTIONS
+from results import ANSWER_CODES, LAYOUT_JSON, LAYOUT_VERSION
+from scoring import TIERS
+from storage import Storage, instrumented, month_start
+from timing import timed
+
+DEFAULT_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+
+# Seconds to wait for a new connection, and the statement timeout used by
+# the app's pool, so a slow server cannot hold a caller for long
+CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", "3"))
+STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+# Consecutive connection failures that open the breaker, and seconds
+# before it lets a trial call through
+BREAKER_THRESHOLD = int(os.environ.get("DB_BREAKER_THRESHOLD", "3"))
+BREAKER_RESET = float(os.environ.get("DB_BREAKER_RESET", "30"))
+
+# Rows each counter is spread over; changing it never loses counts
+COUNTER_SHARDS = int(os.environ.get("DB_COUNTER_SHARDS", "16"))
+
+# Arbitrary key for the advisory lock held while changing the schema
+SCHEMA_LOCK_ID = 727_001
+
+# view_log partitions are created this many months ahead of the current one
+PARTITION_MONTHS_AHEAD = 2
+PARTITION_NAME = re.compile(r"^view_log_y(\d{4})m(\d{2})$")
+
+# Rollup table per bucket size; the key doubles as the date_trunc field
+ROLLUP_TABLES = {
+    "hour": "view_rollup_hourly",
+    "day": "view_rollup_daily",
+}
+
+
+class CountingCursor(extensions.cursor):
+    """Cursor that counts every round trip it makes to the server."""
+
+    def _count(self):
+        conn = self.connection
+        # psycopg2 sends BEGIN on its own before the first statement
+        trips = 2 if (not conn.autocommit
+                      and conn.status == extensions.STATUS_READY) else 1
+        conn.round_trips += trips
+        DB_ROUND_TRIPS.inc(trips)
+
+    def execute(self, query, vars=None):
+        self._count()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        for _ in vars_list:
+            self._count()
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        self._count()
+        return super().copy_expert(sql, file, size)
+
+
+class CountingConnection(extensions.connection):
+    """Connection that counts its round trips and prepared statements."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = CountingCursor
+        self.round_trips = 0
+        # Names of the STATEMENTS prepared on this connection
+        self.prepared = set()
+
+    def _end(self, end):
+        if self.status == extensions.STATUS_BEGIN:
+            self.round_trips += 1
+            DB_ROUND_TRIPS.inc()
+        end()
+
+    def commit(self):
+        self._end(super().commit)
+
+    def rollback(self):
+        self._end(super().rollback)
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections.
+
+    Checkouts block once every connection is in use instead of failing.
+    Each connection is health-checked on checkout and replaced if the
+    server dropped it, so one broken connection never poisons the pool.
+    Connections idle for less than ping_after seconds skip the round trip.
+
+    Connection errors and timeouts count towards a circuit breaker; while
+    it is open, checkouts raise breaker.CircuitOpenError at once instead
+    of waiting on an unreachable server.
+    """
+
+    def __init__(self, dsn=None, minconn=1, maxconn=DEFAULT_POOL_SIZE,
+                 timeout=10.0, ping_after=30.0,
+                 connect_timeout=CONNECT_TIMEOUT, statement_timeout=None):
+        self.dsn = dsn or os.environ.get("DATABASE_URL")
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.breaker = CircuitBreaker("database",
+                                      failure_threshold=BREAKER_THRESHOLD,
+                                      reset_timeout=BREAKER_RESET)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        options = {
+            "connect_timeout": connect_timeout,
+            "connection_factory": CountingConnection,
+        }
+        if statement_timeout:
+            options["options"] = f"-c statement_timeout={statement_timeout}"
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn,
+                                                    self.dsn, **options)
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        idle_since = self._last_used.get(id(conn))
+        if idle_since is not None and (time.monotonic() - idle_since
+                                       < self.ping_after):
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @timed("db.getconn")
+    def getconn(self):
+        self.breaker.before_call()
+        if not self._slots.acquire(timeout=self.timeout):
+            self.breaker.record_failure()
+            raise pg_pool.PoolError("timed out waiting for a connection")
+        try:
+            conn = self._pool.getconn()
+            if not self._healthy(conn):
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            return conn
+        except Exception:
+            self._slots.release()
+            self.breaker.record_failure()
+            raise
+
+    def putconn(self, conn, close=False):
+        close = close or bool(conn.closed)
+        if close:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, autocommit=False, no_timeout=False):
+        """Check out a connection; commit on success, roll back on error.
+
+        With autocommit each statement is its own transaction, which
+        saves the BEGIN and COMMIT round trips around a single statement.
+        no_timeout lifts the statement timeout for the transaction, for
+        exports and maintenance that read whole tables; a cancelled
+        statement there does not count towards the breaker. It cannot
+        be combined with autocommit.
+        """
+        conn = self.getconn()
+        conn.autocommit = autocommit
+        broken = False
+        try:
+            if no_timeout:
+                with conn.cursor() as cur:
+                    cur.execute("SET LOCAL statement_timeout = 0")
+            yield conn
+            conn.commit()
+            self.breaker.record_success()
+        except Exception as e:
+            # Only server trouble (lost connections, timeouts) trips the
+            # breaker; any other error still proves the server answered
+            if isinstance(e, psycopg2.OperationalError) and not (
+                    no_timeout
+                    and isinstance(e, extensions.QueryCanceledError)):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if conn.closed:
+                broken = True
+            else:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            raise
+        finally:
+            if autocommit and not conn.closed:
+                conn.autocommit = False
+            self.putconn(conn, close=broken)
+
+    @contextmanager
+    def cursor(self, *args, autocommit=False, no_timeout=False, **kwargs):
+        with self.connection(autocommit, no_timeout) as conn:
+            with conn.cursor(*args, **kwargs) as cur:
+                yield cur
+
+    def close(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # No connections are opened up front, so creating the
+                # pool never blocks even when the server is down
+                _pool = ConnectionPool(minconn=0,
+                                       statement_timeout=STATEMENT_TIMEOUT_MS)
+    return _pool
+
+
+def _partition_name(month):
+    return f"view_log_y{month:%Y}m{month:%m}"
+
+
+def _is_partitioned(cur, table):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+                (table, ))
+    return cur.fetchone()[0] == "p"
+
+
+def _create_view_log(cur):
+    # The (timestamp, id) primary key doubles as the index behind the
+    # "latest rows" query and keyset pagination, in every partition
+    cur.execute("""
+        CREATE TABLE view_log (
+            id BIGSERIAL,
+            view_type VARCHAR(50) NOT NULL,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (timestamp, id)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+
+
+def _partition_view_log(cur):
+    """Move an unpartitioned view_log into a new monthly-partitioned one."""
+    cur.execute("ALTER TABLE view_log RENAME TO view_log_unpartitioned")
+    _create_view_log(cur)
+    cur.execute("SELECT min(timestamp) FROM view_log_unpartitioned")
+    oldest = cur.fetchone()[0]
+    if oldest is not None:
+        ensure_partitions(cur, since=oldest)
+    cur.execute("""
+        INSERT INTO view_log (id, view_type, timestamp)
+        SELECT id, view_type, COALESCE(timestamp, CURRENT_TIMESTAMP)
+        FROM view_log_unpartitioned
+    """)
+    cur.execute("""
+        SELECT setval(pg_get_serial_sequence('view_log', 'id'),
+                      COALESCE(max(id), 0) + 1, false)
+        FROM view_log
+    """)
+    cur.execute("DROP TABLE view_log_unpartitioned")
+
+
+def ensure_partitions(cur, since=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Create monthly view_log partitions from `since` through the future."""
+    month = month_start(since or datetime.now())
+    last = month_start(datetime.now(), months_ahead)
+    while month <= last:
+        cur.execute(
+            sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {partition} PARTITION OF view_log
+            FOR VALUES FROM (%s) TO (%s)
+        """).format(partition=sql.Identifier(_partition_name(month))),
+            (month, month_start(month, 1)))
+        month = month_start(month, 1)
+
+
+@instrumented("maintain_partitions")
+def maintain_partitions(pool):
+    """Create any view_log partitions missing up to the months ahead."""
+    with pool.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID, ))
+        ensure_partitions(cur)
+
+
+@instrumented("init_schema")
+def init_schema(pool):
+    """Create or upgrade the counter, view log and rollup tables.
+
+    A view_log created before partitioning is migrated in place, and
+    partitions are created through PARTITION_MONTHS_AHEAD months from now.
+    """
+    with pool.cursor() as cur:
+        # Serialize schema changes between app processes
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID, ))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS view_counter (
+                id SERIAL PRIMARY KEY,
+                counter_name VARCHAR(50) NOT NULL,
+                shard SMALLINT NOT NULL DEFAULT 0,
+                count INTEGER DEFAULT 0,
+                UNIQUE (counter_name, shard)
+            )
+        """)
+        # Upgrade a counter table from before sharding; existing totals
+        # become shard 0
+        cur.execute("""
+            ALTER TABLE view_counter
+            ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0
+        """)
+        cur.execute("""
+            ALTER TABLE view_counter
+            DROP CONSTRAINT IF EXISTS view_counter_counter_name_key
+        """)
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS view_counter_counter_name_shard_key
+            ON view_counter (counter_name, shard)
+        """)
+        cur.execute("""
+            INSERT INTO view_counter (counter_name, count)
+            VALUES ('assessments', 0), ('page_views', 0)
+            ON CONFLICT (counter_name, shard) DO NOTHING
+        """)
+        cur.execute("SELECT to_regclass('view_log')::text")
+        if cur.fetchone()[0] is None:
+            _create_view_log(cur)
+        elif not _is_partitioned(cur, "view_log"):
+            _partition_view_log(cur)
+        # Lets the admin view log fetch rows written since the last id it
+        # saw, whatever their timestamp
+        cur.execute("CREATE INDEX IF NOT EXISTS view_log_id ON view_log (id)")
+        ensure_partitions(cur)
+        for field, table in ROLLUP_TABLES.items():
+            cur.execute(
+                sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket TIMESTAMP NOT NULL,
+                    view_type VARCHAR(50) NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (bucket, view_type)
+                )
+            """).format(table=sql.Identifier(table)))
+            # Backfill once from the raw log when the rollup is first created
+            cur.execute(
+                sql.SQL("""
+                INSERT INTO {table} (bucket, view_type, count)
+                SELECT date_trunc({field}, timestamp), view_type, count(*)
+                FROM view_log
+                WHERE NOT EXISTS (SELECT 1 FROM {table})
+                GROUP BY 1, 2
+            """).format(table=sql.Identifier(table),
+                        field=sql.Literal(field)))
+        _create_results(cur)
+
+
+def _create_results(cur):
+    """Create the anonymized assessment results table and its rollups."""
+    cur.execute("SELECT to_regtype('risk_tier')::text")
+    if cur.fetchone()[0] is None:
+        cur.execute(
+            sql.SQL("CREATE TYPE risk_tier AS ENUM ({tiers})").format(
+                tiers=sql.SQL(", ").join(map(sql.Literal, TIERS))))
+    # Fixed-width columns first, so rows pack without alignment padding
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS assessment_result (
+            completed_at TIMESTAMP NOT NULL,
+            layout INTEGER NOT NULL,
+            points SMALLINT NOT NULL,
+            age_band SMALLINT NOT NULL,
+            triggers SMALLINT NOT NULL,
+            emergency_override BOOLEAN NOT NULL,
+            tier risk_tier NOT NULL,
+            language VARCHAR(8) NOT NULL,
+            answers SMALLINT[] NOT NULL
+        )
+    """)
+    # Rows from before layouts were recorded used the layout of the code
+    # that upgrades them
+    cur.execute(
+        sql.SQL("""
+        ALTER TABLE assessment_result
+        ADD COLUMN IF NOT EXISTS layout INTEGER NOT NULL DEFAULT {layout}
+    """).format(layout=sql.Literal(LAYOUT_VERSION)))
+    cur.execute("ALTER TABLE assessment_result ALTER COLUMN layout DROP DEFAULT")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS result_layout (
+            layout INTEGER PRIMARY KEY,
+            questions JSONB NOT NULL
+        )
+    """)
+    cur.execute(
+        """
+        INSERT INTO result_layout (layout, questions) VALUES (%s, %s)
+        ON CONFLICT (layout) DO NOTHING
+    """, (LAYOUT_VERSION, LAYOUT_JSON))
+    # Rows arrive in time order, so a BRIN index covers them in a few pages
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS assessment_result_completed_at
+        ON assessment_result USING brin (completed_at)
+    """)
+    # The admin figures read only these, so they cost the same however
+    # many results are stored
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS result_rollup_daily (
+            bucket TIMESTAMP NOT NULL,
+            language VARCHAR(8) NOT NULL,
+            tier risk_tier NOT NULL,
+            emergency_override BOOLEAN NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, language, tier, emergency_override)
+        )
+    """)
+    cur.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'answer_rollup_daily' AND column_name = 'question'
+    """)
+    positional = cur.fetchone() == ("smallint", )
+    if positional:
+        cur.execute("ALTER TABLE answer_rollup_daily "
+                    "RENAME TO answer_rollup_daily_positional")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS answer_rollup_daily (
+            bucket TIMESTAMP NOT NULL,
+            question VARCHAR(50) NOT NULL,
+            answer VARCHAR(50) NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, question, answer)
+        )
+    """)
+    if positional:
+        # Rollups keyed by position are taken to match the current layout
+        cur.execute(f"""
+            INSERT INTO answer_rollup_daily (bucket, question, answer, count)
+            SELECT bucket, codes.question, codes.answer, count
+            FROM answer_rollup_daily_positional
+            JOIN ({ANSWER_CODES_SQL}) AS codes(number, code, question, answer)
+                ON (number, code) = (answer_rollup_daily_positional.question,
+                                     answer_rollup_daily_positional.answer)
+        """)
+        cur.execute("DROP TABLE answer_rollup_daily_positional")
+
+
+# ANSWER_CODES as a VALUES list, to turn stored answer positions into
+# the question and option codes the answer rollups are keyed on
+ANSWER_CODES_SQL = "VALUES " + ", ".join(
+    "({}, {}, '{}', '{}')".format(number, code, question.replace("'", "''"),
+                                  option.replace("'", "''"))
+    for number, code, question, option in ANSWER_CODES)
+
+# Hot statements, prepared once per pooled connection by execute_prepared()
+# so the server parses and plans them only on first use: name ->
+# (parameter types, query)
+STATEMENTS = {
+    # Counter increments, view_log rows, assessment results and all their
+    # rollups in one round trip
+    "write_events": (
+        "varchar[], smallint[], integer[], varchar[], timestamp[], "
+        "timestamp[], varchar[], varchar[], boolean[], smallint[], "
+        "smallint[], smallint[], varchar[]", f"""
+        WITH counters AS (
+            INSERT INTO view_counter (counter_name, shard, count)
+            SELECT * FROM unnest($1, $2, $3)
+            ORDER BY 1
+            ON CONFLICT (counter_name, shard)
+            DO UPDATE SET count = view_counter.count + EXCLUDED.count
+        ), logged AS (
+            INSERT INTO view_log (view_type, timestamp)
+            SELECT * FROM unnest($4, $5)
+            RETURNING view_type, timestamp
+        ), hourly AS (
+            INSERT INTO view_rollup_hourly (bucket, view_type, count)
+            SELECT date_trunc('hour', timestamp), view_type, count(*)
+            FROM logged
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+            ON CONFLICT (bucket, view_type)
+            DO UPDATE SET count = view_rollup_hourly.count + EXCLUDED.count
+        ), daily AS (
+            INSERT INTO view_rollup_daily (bucket, view_type, count)
+            SELECT date_trunc('day', timestamp), view_type, count(*)
+            FROM logged
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+            ON CONFLICT (bucket, view_type)
+            DO UPDATE SET count = view_rollup_daily.count + EXCLUDED.count
+        ), results AS (
+            INSERT INTO assessment_result (
+                completed_at, layout, language, tier, emergency_override,
+                points, age_band, triggers, answers)
+            SELECT completed_at, {LAYOUT_VERSION}, language, tier::risk_tier,
+                   emergency_override, points, age_band, triggers,
+                   answers::smallint[]
+            FROM unnest($6, $7, $8, $9, $10, $11, $12, $13)
+                AS r(completed_at, language, tier, emergency_override,
+                     points, age_band, triggers, answers)
+            RETURNING completed_at, language, tier, emergency_override,
+                      triggers, answers
+        ), result_daily AS (
+            INSERT INTO result_rollup_daily (
+                bucket, language, tier, emergency_override, count)
+            SELECT date_trunc('day', completed_at), language, tier,
+                   emergency_override, count(*)
+            FROM results
+            GROUP BY 1, 2, 3, 4
+            ORDER BY 1, 2, 3, 4
+            ON CONFLICT (bucket, language, tier, emergency_override)
+            DO UPDATE SET count = result_rollup_daily.count + EXCLUDED.count
+        ), answer_daily AS (
+            INSERT INTO answer_rollup_daily (bucket, question, answer, count)
+            SELECT date_trunc('day', completed_at), codes.question,
+                   codes.answer, count(*)
+            FROM (
+                SELECT completed_at, number - 1 AS number, code
+                FROM results,
+                     unnest(answers) WITH ORDINALITY AS a(code, number)
+                WHERE code >= 0
+                UNION ALL
+                SELECT completed_at, {len(CHOICE_QUESTIONS)}, bit
+                FROM results,
+                     generate_series(0, {len(OPTIONS["triggers"]) - 1}) bit
+                WHERE triggers & (1 << bit) <> 0
+            ) answered
+            JOIN ({ANSWER_CODES_SQL}) AS codes(number, code, question, answer)
+                USING (number, code)
+            GROUP BY 1, 2, 3
+            ORDER BY 1, 2, 3
+            ON CONFLICT (bucket, question, answer)
+            DO UPDATE SET count = answer_rollup_daily.count + EXCLUDED.count
+        )
+        SELECT count(*) FROM logged
+    """),
+    "get_counter": (
+        "varchar", """
+        SELECT sum(count) FROM view_counter WHERE counter_name = $1
+    """),
+}
+
+
+def execute_prepared(cur, name, params):
+    """Run one of STATEMENTS, preparing it first if this connection has not.
+
+    PREPARE outlives rollbacks, so a statement is only prepared again on
+    a new connection.
+    """
+    conn = cur.connection
+    if name not in conn.prepared:
+        types, query = STATEMENTS[name]
+        cur.execute(f"PREPARE {name} ({types}) AS {query}")
+        conn.prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders})", params)
+
+
+@instrumented("write_events")
+def write_event_batch(cur, counts, log_rows, results=()):
+    """Write one (counts, log_rows, results) batch in a single round trip.
+
+    Each counter increment goes to one random shard, so concurrent
+    writers do not queue on a single hot row lock. Returns the number of
+    log rows written.
+    """
+    names = sorted(counts)
+    # Result rows as columns, with answer codes sent as array literals
+    columns = [list(column) for column in zip(*results)] or [[]] * 8
+    columns[7] = ["{%s}" % ",".join(map(str, codes)) for codes in columns[7]]
+    execute_prepared(cur, "write_events", (
+        names,
+        [random.randrange(COUNTER_SHARDS) for _ in names],
+        [counts[name] for name in names],
+        [view_type for view_type, _ in log_rows],
+        [timestamp for _, timestamp in log_rows],
+        *columns,
+    ))
+    return cur.fetchone()[0]
+
+
+@instrumented("get_counter")
+def get_counter(pool, counter_name='assessments'):
+    with pool.cursor(autocommit=True) as cur:
+        execute_prepared(cur, "get_counter", (counter_name, ))
+        return cur.fetchone()[0] or 0
+
+
+@instrumented("copy_view_log_csv")
+def copy_view_log_csv(pool, out):
+    """Stream the full view log as CSV into a binary file object.
+
+    Rows go straight from COPY into out in small buffers, so memory use
+    stays flat however large the log is. The pool's statement timeout
+    does not apply.
+    """
+    with pool.cursor(no_timeout=True) as cur:
+        cur.copy_expert(
+            """
+            COPY (SELECT view_type AS "Type", timestamp AS "Timestamp"
+                  FROM view_log ORDER BY timestamp DESC)
+            TO STDOUT WITH (FORMAT csv, HEADER)
+        """, out)
+
+
+@instrumented("get_rollups")
+def get_rollups(pool, field, since):
+    """Return (bucket, view_type, count) rows from a rollup since a time."""
+    with pool.cursor() as cur:
+        cur.execute(
+            sql.SQL("""
+            SELECT bucket, view_type, count FROM {table}
+            WHERE bucket >= %s
+            ORDER BY bucket
+        """).format(table=sql.Identifier(ROLLUP_TABLES[field])), (since, ))
+        return cur.fetchall()
+
+
+@instrumented("get_tier_counts")
+def get_tier_counts(pool, since=None):
+    """Return (language, tier, assessments, emergency overrides) rows."""
+    with pool.cursor(autocommit=True) as cur:
+        cur.execute(
+            """
+            SELECT language, tier::text, sum(count),
+                   coalesce(sum(count) FILTER (WHERE emergency_override), 0)
+            FROM result_rollup_daily
+            WHERE bucket >= %s
+            GROUP BY language, tier
+            ORDER BY tier, language
+        """, (since or datetime.min, ))
+        return cur.fetchall()
+
+
+@instrumented("get_answer_prevalence")
+def get_answer_prevalence(pool, since=None):
+    """Return (question, option, count, share of assessments) rows."""
+    since = since or datetime.min
+    with pool.cursor(autocommit=True) as cur:
+        cur.execute(
+            """
+            SELECT question, answer, sum(count),
+                   sum(count)::float / (SELECT sum(count)
+                                        FROM result_rollup_daily
+                                        WHERE bucket >= %s)
+            FROM answer_rollup_daily
+            WHERE bucket >= %s
+            GROUP BY question, answer
+            ORDER BY question, answer
+        """, (since, since))
+        return cur.fetchall()
+
+
+@instrumented("apply_retention")
+def apply_retention(pool, keep_months, archive_dir=None):
+    """Drop view_log partitions older than keep_months whole months.
+
+    With archive_dir set, each partition is first copied to a gzipped CSV
+    file there. Returns the names of the dropped partitions. Rollups are
+    left alone, so dashboard history outlives the raw log.
+    """
+    cutoff = month_start(datetime.now(), -keep_months)
+    with pool.cursor() as cur:
+        cur.execute("""
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass('view_log')
+            ORDER BY child.relname
+        """)
+        partitions = [row[0] for row in cur.fetchall()]
+
+    dropped = []
+    for partition in partitions:
+        match = PARTITION_NAME.match(partition)
+        if not match:
+            continue
+        if datetime(int(match[1]), int(match[2]), 1) >= cutoff:
+            break
+        # Archiving a month of log can outlast the statement timeout
+        with pool.cursor(no_timeout=True) as cur:
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+                path = os.path.join(archive_dir, f"{partition}.csv.gz")
+                with gzip.open(path, "wb") as out:
+                    cur.copy_expert(
+                        sql.SQL("COPY {partition} TO STDOUT WITH "
+                                "(FORMAT csv, HEADER)").format(
+                                    partition=sql.Identifier(partition)
+                                ).as_string(cur), out)
+            cur.execute(
+                sql.SQL("ALTER TABLE view_log DETACH PARTITION {partition}").
+                format(partition=sql.Identifier(partition)))
+            cur.execute(
+                sql.SQL("DROP TABLE {partition}").format(
+                    partition=sql.Identifier(partition)))
+        dropped.append(partition)
+    return dropped
+
+
+@instrumented("get_view_log_page")
+def get_view_log_page(pool, limit=50, before=None, after_id=None):
+    """Return up to `limit` view_log rows, newest first.
+
+    Rows are (id, view_type, timestamp). `before` is the (timestamp, id)
+    key the page starts before, so each page is a short index range scan
+    however deep it is or however large the table grows. `after_id` keeps
+    only rows with a higher id, whatever their timestamp. Ids are taken at
+    insert rather than commit, so a poller must re-read a margin below
+    the highest id it has seen to catch rows that committed late.
+    """
+    conditions = []
+    params = []
+    if before is not None:
+        conditions.append("(timestamp, id) < (%s, %s)")
+        params.extend(before)
+    if after_id is not None:
+        conditions.append("id > %s")
+        params.append(after_id)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    with pool.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT id, view_type, timestamp FROM view_log
+            {where}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT %s
+        """, params + [limit])
+        return cur.fetchall()
+
+
+class PostgresStorage(Storage):
+    """Storage backed by a ConnectionPool and the functions above."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.breaker = pool.breaker
+
+    def init_schema(self):
+        init_schema(self.pool)
+
+    def maintain(self):
+        maintain_partitions(self.pool)
+
+    def is_unavailable(self, error):
+        return isinstance(error, (CircuitOpenError, pg_pool.PoolError,
+                                  psycopg2.OperationalError,
+                                  psycopg2.InterfaceError))
+
+    def write_events(self, batches):
+        written = 0
+        current_month = month_start(datetime.now())
+        # Used for spool replays, which can be large
+        with self.pool.cursor(no_timeout=True) as cur:
+            for counts, log_rows, results in batches:
+                if not log_rows and not results:
+                    continue
+                # Replayed rows can predate the partitions kept ahead
+                oldest = min((timestamp for _, timestamp in log_rows),
+                             default=current_month)
+                if oldest < current_month:
+                    ensure_partitions(cur, since=oldest, months_ahead=0)
+                written += write_event_batch(cur, counts, log_rows, results)
+        return written
+
+    def write_batch(self, counts, log_rows, results=()):
+        if not log_rows and not results:
+            return 0
+        current_month = month_start(datetime.now())
+        if min((timestamp for _, timestamp in log_rows),
+               default=current_month) < current_month:
+            return self.write_events([(counts, log_rows, results)])
+        # One statement, so it needs no transaction of its own
+        with self.pool.cursor(autocommit=True) as cur:
+            return write_event_batch(cur, counts, log_rows, results)
+
+    def get_counter(self, counter_name='assessments'):
+        return get_counter(self.pool, counter_name)
+
+    def get_rollups(self, field, since):
+        return get_rollups(self.pool, field, since)
+
+    def get_tier_counts(self, since=None):
+        return get_tier_counts(self.pool, since)
+
+    def get_answer_prevalence(self, since=None):
+        return get_answer_prevalence(self.pool, since)
+
+    def get_view_log_page(self, limit=50, before=None, after_id=None):
+        return get_view_log_page(self.pool, limit, before, after_id)
+
+    def copy_view_log_csv(self, out):
+        copy_view_log_csv(self.pool, out)
+
+    def apply_retention(self, keep_months, archive_dir=None):
+        return apply_retention(self.pool, keep_months, archive_dir)
+
+    def close(self):
+        self.pool.close()
@@ -1,5 +1,180 @@
-def main():
-    print("Hello from repl-nix-workspace!")
+"""Command line tools that run without the Streamlit app.
+
+    python main.py score answers.csv -o scored.csv
+    python main.py score answers.jsonl -o scored.jsonl --workers 4
+    python main.py init-db
+    python main.py retention --keep-months 24 --archive-dir archive/
+
+For `score`, input rows hold one column per question code (see
+questionnaire.OPTIONS) with option codes as values; in CSV files multiple
+triggers are joined with "|". The file is read and written in chunks, so
+memory use does not grow with the size of the export.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from batch_scoring import score_batch
+from scoring import TIERS
+
+FORMATS = ("csv", "jsonl")
+
+
+def detect_format(path, default="csv"):
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    if ext in ("jsonl", "ndjson"):
+        return "jsonl"
+    if ext == "csv":
+        return "csv"
+    return default
+
+
+def read_chunks(path, fmt, chunk_size):
+    """Yield DataFrame chunks with every cell as it was in the file.
+
+    Types are not inferred, so columns passed through (an ID column with
+    gaps, say) are written back unchanged; scoring parses what it needs.
+    """
+    if fmt == "jsonl":
+        with open(path, encoding="utf-8") as f:
+            lines = (line for line in f if line.strip())
+            while True:
+                records = [json.loads(line)
+                           for line in islice(lines, chunk_size)]
+                if not records:
+                    return
+                yield pd.DataFrame(records, dtype=object)
+    else:
+        with pd.read_csv(path, chunksize=chunk_size, dtype=str,
+                         keep_default_na=False) as reader:
+            yield from reader
+
+
+def score_chunk(chunk):
+    points, emergency_override, tier = score_batch(chunk)
+    return chunk.assign(points=points,
+                        emergency_override=emergency_override,
+                        tier=np.asarray(TIERS, dtype=object)[tier])
+
+
+def score_chunks(chunks, workers):
+    """Score chunks in order, fanning out to a process pool if workers > 1.
+
+    At most two chunks per worker are in flight, so memory stays bounded
+    however far the reader could run ahead.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield score_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(score_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_chunks(scored, out, fmt):
+    rows = 0
+    for i, chunk in enumerate(scored):
+        if fmt == "jsonl":
+            chunk.to_json(out, orient="records", lines=True, force_ascii=False)
+        else:
+            chunk.to_csv(out, header=(i == 0), index=False)
+        out.flush()
+        rows += len(chunk)
+    return rows
+
+
+def run_score(args):
+    input_format = args.input_format or detect_format(args.input)
+    output_format = args.output_format or detect_format(
+        args.output, default=input_format)
+
+    chunks = read_chunks(args.input, input_format, args.chunk_size)
+    scored = score_chunks(chunks, args.workers)
+    if args.output == "-":
+        rows = write_chunks(scored, sys.stdout, output_format)
+    else:
+        with open(args.output, "w", encoding="utf-8", newline="") as out:
+            rows = write_chunks(scored, out, output_format)
+
+    print(f"Scored {rows:,} assessments", file=sys.stderr)
+
+
+def run_init_db(args):
+    from storage import open_storage
+    storage = open_storage(maxconn=1)
+    try:
+        storage.init_schema()
+    finally:
+        storage.close()
+    print("Database schema is up to date", file=sys.stderr)
+
+
+def run_retention(args):
+    from storage import open_storage
+    storage = open_storage(maxconn=1)
+    try:
+        storage.init_schema()
+        dropped = storage.apply_retention(args.keep_months, args.archive_dir)
+    finally:
+        storage.close()
+    for month in dropped:
+        print(f"Dropped {month}", file=sys.stderr)
+    print(f"Dropped {len(dropped)} months of view_log", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Retinal detachment risk tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    score = commands.add_parser(
+        "score", help="score a questionnaire export")
+    score.add_argument("input", help="CSV or JSONL file of answers")
+    score.add_argument("-o", "--output", default="-",
+                       help="output file (default: stdout)")
+    score.add_argument("--input-format", choices=FORMATS)
+    score.add_argument("--output-format", choices=FORMATS)
+    score.add_argument("--chunk-size", type=int, default=50_000,
+                       help="rows read and scored at a time")
+    score.add_argument("--workers", type=int, default=1,
+                       help="processes used to score chunks")
+    score.set_defaults(run=run_score)
+
+    init_db = commands.add_parser(
+        "init-db",
+        help="create or upgrade the database schema (uses DATABASE_URL, "
+        "postgresql://... or sqlite:///path.db)")
+    init_db.set_defaults(run=run_init_db)
+
+    retention = commands.add_parser(
+        "retention",
+        help="drop old months of view_log (uses DATABASE_URL)")
+    retention.add_argument("--keep-months", type=int, default=24,
+                           help="whole months of raw log to keep")
+    retention.add_argument("--archive-dir",
+                           help="save dropped months here as .csv.gz")
+    retention.set_defaults(run=run_retention)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.run(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,197 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms live in this process only, so scraping
+them never touches the database or renders Streamlit. start_server()
+serves them at http://<host>:<port>/metrics from a daemon thread.
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds for DB call latency
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+              2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"'
+                          for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._function = None
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def set_function(self, function):
+        """Read the (unlabelled) value from function() at scrape time."""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                return [(self.name, (), (), self._function())]
+            except Exception:
+                return []
+        with self._lock:
+            return [(self.name, key, (), value)
+                    for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labels, key, extra)} "
+                         f"{_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        if not self.labels:
+            # Export 0 from the start, so rate() sees the first increment
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DB_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket plus +Inf, then the running sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1)
+                counts.append(0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {
+                key: list(counts)
+                for key, counts in self._values.items()
+            }
+        samples = []
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                samples.append((f"{self.name}_bucket", key,
+                                (("le", _format_value(bound)), ), cumulative))
+            samples.append((f"{self.name}_sum", key, (), counts[-1]))
+            samples.append((f"{self.name}_count", key, (), cumulative))
+        return samples
+
+
+def render():
+    """Return every registered metric in the text exposition format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+PAGE_VIEWS = Counter("retina_page_views_total",
+                     "Sessions that opened the app.")
+ASSESSMENTS = Counter("retina_assessments_total",
+                      "Completed assessments by risk tier.", ("tier", ))
+EMERGENCY_OVERRIDES = Counter(
+    "retina_emergency_overrides_total",
+    "Assessments forced to very high risk by an emergency answer.")
+DB_LATENCY = Histogram("retina_db_call_duration_seconds",
+                       "Duration of database calls.", ("operation", ))
+DB_ROUND_TRIPS = Counter(
+    "retina_db_round_trips_total",
+    "Statements and transaction commands sent to the database.")
+QUEUE_DEPTH = Gauge("retina_telemetry_queue_depth",
+                    "Telemetry events waiting to be written, spooled or not.")
+SCORE_CACHE_HITS = Counter("retina_score_cache_hits_total",
+                           "Assessments scored from memoized results.")
+SCORE_CACHE_MISSES = Counter("retina_score_cache_misses_total",
+                             "Assessments that had to be scored.")
+SPOOLED_EVENTS = Gauge("retina_telemetry_spooled_events",
+                       "Telemetry events spooled to disk, awaiting replay.")
+DB_BREAKER_OPEN = Gauge("retina_db_breaker_open",
+                        "1 while the database circuit breaker is open.")
+DROPPED_EVENTS = Counter("retina_telemetry_dropped_events_total",
+                         "Telemetry events dropped after a failed write.")
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port, host="127.0.0.1"):
+    """Serve /metrics on host:port from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever,
+                     name="metrics-server",
+                     daemon=True).start()
+    return server
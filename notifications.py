@@ -0,0 +1,177 @@
+"""Visitor notification digests, sent from a background thread.
+
+The Streamlit script thread only bumps an in-memory count. A worker
+thread sends one SendGrid email per digest, every interval seconds or
+as soon as max_visits visits are waiting, through a single pooled HTTP
+session that retries with exponential backoff. A slow or failing mail
+provider therefore never delays a page load; visits from a digest that
+could not be sent roll into the next one, which waits at least interval
+seconds however many visits pile up.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+SENDGRID_URL = os.environ.get("SENDGRID_URL",
+                              "https://api.sendgrid.com/v3/mail/send")
+
+
+def make_session(retries=3, backoff_factor=1.0, pool_size=1):
+    """Return a session that retries failed and throttled requests."""
+    retry = Retry(total=retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["POST"]),
+                  respect_retry_after_header=True)
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=retry,
+                          pool_connections=pool_size,
+                          pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class NotificationDigest:
+
+    def __init__(self, api_key, notify_email, interval=3600.0, max_visits=50,
+                 get_total_views=None, url=SENDGRID_URL, timeout=5.0,
+                 session=None):
+        self.api_key = api_key
+        self.notify_email = notify_email
+        self.interval = interval
+        self.max_visits = max_visits
+        # Called from the worker thread, never from the script thread
+        self.get_total_views = get_total_views
+        self.url = url
+        self.timeout = timeout
+        self.session = session or make_session()
+        self.sent = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._visits = 0
+        self._first_visit = None
+        self._last_visit = None
+        # time.monotonic() before which no digest is sent after a failure
+        self._retry_at = 0.0
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run,
+                                        name="notification-digest",
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def record_visit(self):
+        """Count one new visitor towards the next digest."""
+        now = datetime.now()
+        with self._lock:
+            self._visits += 1
+            self._first_visit = self._first_visit or now
+            self._last_visit = now
+            pending = self._visits
+        if pending >= self.max_visits and time.monotonic() >= self._retry_at:
+            self._wake.set()
+
+    def _take(self):
+        with self._lock:
+            taken = (self._visits, self._first_visit, self._last_visit)
+            self._visits = 0
+            self._first_visit = self._last_visit = None
+        return taken
+
+    def _put_back(self, visits, first_visit, last_visit):
+        with self._lock:
+            self._visits += visits
+            self._first_visit = min(filter(None,
+                                           (first_visit, self._first_visit)))
+            self._last_visit = max(filter(None,
+                                          (last_visit, self._last_visit)))
+
+    def message(self, visits, first_visit, last_visit, total_views=None):
+        """Return the SendGrid request body for one digest."""
+        subject = f"Retinal Risk App - New Visitors: {visits}"
+        lines = [
+            "New visitors opened the Retinal Detachment Risk Assessment app.",
+            "",
+            f"Visitors: {visits}",
+            f"First visit: {first_visit:%Y-%m-%d %H:%M:%S}",
+            f"Last visit: {last_visit:%Y-%m-%d %H:%M:%S}",
+        ]
+        if total_views is not None:
+            subject += f" (Total: {total_views:,})"
+            lines.append(f"Total Page Views: {total_views:,}")
+        return {
+            "personalizations": [{
+                "to": [{
+                    "email": self.notify_email
+                }]
+            }],
+            "from": {
+                "email": self.notify_email
+            },
+            "subject": subject,
+            "content": [{
+                "type": "text/plain",
+                "value": "\n".join(lines)
+            }]
+        }
+
+    def flush(self):
+        """Send a digest of the waiting visits; return True if one was sent."""
+        visits, first_visit, last_visit = self._take()
+        if not visits:
+            return False
+        total_views = None
+        if self.get_total_views is not None:
+            try:
+                total_views = self.get_total_views()
+            except Exception:
+                logger.warning("Could not read the page view total",
+                               exc_info=True)
+        try:
+            response = self.session.post(
+                self.url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                json=self.message(visits, first_visit, last_visit,
+                                  total_views),
+                timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            self.failed += 1
+            self._retry_at = time.monotonic() + self.interval
+            self._put_back(visits, first_visit, last_visit)
+            logger.exception("Could not send a digest of %d visits", visits)
+            return False
+        self.sent += 1
+        return True
+
+    def _run(self):
+        while not self._stopping:
+            backoff = self._retry_at - time.monotonic()
+            self._wake.wait(backoff if backoff > 0 else self.interval)
+            self._wake.clear()
+            if time.monotonic() >= self._retry_at:
+                self.flush()
+
+    def stop(self, timeout=5.0):
+        """Stop the worker and send whatever is still waiting."""
+        if self._stopping:
+            return
+        self._stopping = True
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
@@ -0,0 +1,280 @@
+"""Declarative schema for the questionnaire.
+
+Every question is described once here: its widget, option codes, point
+weights, the answer that reveals it (for follow-ups) and whether it is
+required. Codes double as translation keys for labels and options.
+
+The schema is compiled at import into flat tables used for rendering
+(SECTIONS, WIDGET_KEYS), validation (REQUIRED) and scoring (OPTIONS,
+CHOICE_QUESTIONS, FOLLOW_UPS, ANSWER_POINTS, EMERGENCY_ANSWERS,
+AGE_BANDS, TRIGGER_POINTS).
+
+Question fields:
+    code       answer and translation key
+    widget     "radio" (default), "number" or "multiselect"
+    options    option codes, in display order
+    points     {option: points}; options not listed score 0
+    parent     question whose answer reveals this follow-up
+    reveal     parent answers that reveal it
+    keys       {parent answer: widget key} when a follow-up uses a
+               different widget per parent answer
+    emergency  answer that forces the very high tier
+    bands      ((minimum, points), ...) for number questions, highest first
+    groups     (((options...), points), ...) for multiselect questions;
+               any selected option in a group adds its points once
+    required   False for optional questions (default True)
+"""
+
+ONSET_48H = ("onset_more_48h", "onset_48h")
+ONSET_24H = ("onset_more_24h", "onset_24h")
+
+# Sections in display order; each holds one or two columns of questions,
+# with follow-ups listed directly after their parent
+SCHEMA = (
+    {
+        "title": "section_a",
+        "columns": ((
+            {
+                "code": "age",
+                "widget": "number",
+                "min": 0,
+                "max": 120,
+                "placeholder": "age_placeholder",
+                "bands": ((70, 3), (60, 2), (40, 1)),
+            },
+        ), (
+            {
+                "code": "sex",
+                "options": ("female", "male"),
+                "points": {"male": 1},
+            },
+        )),
+    },
+    {
+        "title": "section_b",
+        "columns": ((
+            {
+                "code": "prior_rd",
+                "options": ("no", "yes"),
+                "points": {"yes": 5},
+            },
+            {
+                "code": "cataract",
+                "options": ("no", "yes", "not_sure"),
+                "points": {"yes": 2},
+            },
+            {
+                "code": "yag",
+                "options": ("no", "yes", "not_sure"),
+                "points": {"yes": 2},
+            },
+        ), (
+            {
+                "code": "myopia",
+                "options": ("no", "yes"),
+            },
+            {
+                "code": "myopia_level",
+                "options": ("myopia_none", "myopia_mild", "myopia_moderate",
+                            "myopia_high", "dont_know"),
+                "points": {"myopia_mild": 1, "myopia_moderate": 2,
+                           "myopia_high": 4},
+                "parent": "myopia",
+                "reveal": ("yes", ),
+            },
+            {
+                "code": "retinal_condition",
+                "options": ("no", "yes", "not_sure"),
+                "points": {"yes": 4},
+            },
+            {
+                "code": "eye_trauma",
+                "options": ("no", "yes"),
+                "points": {"yes": 3},
+            },
+        )),
+    },
+    {
+        "title": "section_c",
+        "columns": ((
+            {
+                "code": "diabetes",
+                "options": ("no", "yes", "not_sure"),
+                "points": {"yes": 1},
+            },
+        ), (
+            {
+                "code": "family_history",
+                "options": ("no", "yes", "not_sure"),
+                "points": {"yes": 3},
+            },
+        )),
+    },
+    {
+        "title": "section_d",
+        "columns": ((
+            {
+                "code": "floaters",
+                "options": ("no", "yes"),
+                "points": {"yes": 3},
+            },
+            {
+                "code": "floaters_onset",
+                "options": ONSET_48H,
+                "points": {"onset_48h": 1},
+                "parent": "floaters",
+                "reveal": ("yes", ),
+            },
+            {
+                "code": "flashes",
+                "options": ("flashes_none", "flashes_occasional",
+                            "flashes_frequent"),
+                "points": {"flashes_occasional": 2, "flashes_frequent": 3},
+            },
+            {
+                "code": "flashes_onset",
+                "options": ONSET_48H,
+                "points": {"onset_48h": 1},
+                "parent": "flashes",
+                "reveal": ("flashes_occasional", "flashes_frequent"),
+                # A separate widget per flash frequency, so changing the
+                # frequency clears the onset answer
+                "keys": {"flashes_frequent": "flashes_onset2"},
+            },
+            {
+                "code": "shadow",
+                "options": ("no", "yes"),
+                "points": {"yes": 8},
+            },
+            {
+                "code": "shadow_onset",
+                "options": ONSET_24H,
+                "points": {"onset_24h": 2},
+                "parent": "shadow",
+                "reveal": ("yes", ),
+                "emergency": "onset_24h",
+            },
+        ), (
+            {
+                "code": "vision_decrease",
+                "options": ("no", "yes"),
+                "points": {"yes": 5},
+            },
+            {
+                "code": "vision_onset",
+                "options": ONSET_24H,
+                "points": {"onset_24h": 2},
+                "parent": "vision_decrease",
+                "reveal": ("yes", ),
+                "emergency": "onset_24h",
+            },
+            {
+                "code": "pain",
+                "options": ("no", "yes"),
+                "points": {"yes": 1},
+            },
+        )),
+    },
+    {
+        "title": "section_e",
+        "columns": ((
+            {
+                "code": "vision_level",
+                "options": ("vision_2020", "vision_2030", "vision_2080",
+                            "vision_worse", "dont_know"),
+                "points": {"vision_2030": 1, "vision_2080": 2,
+                           "vision_worse": 3},
+            },
+        ), (
+            {
+                "code": "last_exam",
+                "options": ("exam_within_2", "exam_more_2", "exam_never"),
+                "points": {"exam_more_2": 1, "exam_never": 2},
+            },
+        )),
+    },
+    {
+        "title": "section_f",
+        "columns": ((
+            {
+                "code": "triggers",
+                "widget": "multiselect",
+                "options": ("trigger_trauma", "trigger_sports",
+                            "trigger_lifting", "trigger_none", "not_sure"),
+                "groups": ((("trigger_trauma", "trigger_sports"), 3),
+                           (("trigger_lifting", ), 1)),
+            },
+        ), ),
+    },
+)
+
+
+def _compile_question(question):
+    question = dict(question)
+    question.setdefault("widget", "radio")
+    question.setdefault("required", True)
+    question["keys"] = dict(question.get("keys", {}))
+    return question
+
+
+# Sections with defaults filled in, ready for the renderer
+SECTIONS = tuple({
+    "title": section["title"],
+    "columns": tuple(
+        tuple(_compile_question(question) for question in column)
+        for column in section["columns"]),
+} for section in SCHEMA)
+
+# Every question in display order
+QUESTION_SPECS = tuple(question for section in SECTIONS
+                       for column in section["columns"]
+                       for question in column)
+QUESTIONS = tuple(question["code"] for question in QUESTION_SPECS)
+
+OPTIONS = {
+    question["code"]: question["options"]
+    for question in QUESTION_SPECS if "options" in question
+}
+# Single-choice questions, in the order of encoded answer codes
+CHOICE_QUESTIONS = tuple(q for q in OPTIONS if q != "triggers")
+FOLLOW_UPS = {
+    question["code"]: (question["parent"], question["reveal"])
+    for question in QUESTION_SPECS if "parent" in question
+}
+ANSWER_POINTS = {
+    question["code"]: question["points"]
+    for question in QUESTION_SPECS if "points" in question
+}
+EMERGENCY_ANSWERS = {
+    question["code"]: question["emergency"]
+    for question in QUESTION_SPECS if "emergency" in question
+}
+AGE_BANDS = next(question["bands"] for question in QUESTION_SPECS
+                 if question["code"] == "age")
+TRIGGER_POINTS = next(question["groups"] for question in QUESTION_SPECS
+                      if question["code"] == "triggers")
+REQUIRED = tuple(question["code"] for question in QUESTION_SPECS
+                 if question["required"])
+
+# Widget key prefix per question, with per-parent-answer overrides
+WIDGET_KEYS = {
+    question["code"]: (question["code"], question["keys"])
+    for question in QUESTION_SPECS
+}
+
+
+def widget_key(question, answers, v):
+    """Return the session state key of a question's widget."""
+    default, by_parent_answer = WIDGET_KEYS[question]
+    if by_parent_answer:
+        parent = FOLLOW_UPS[question][0]
+        default = by_parent_answer.get(answers.get(parent), default)
+    return f"{default}_{v}"
+
+
+def field_labels(t):
+    """Return {question: label} for validation messages in one language."""
+    return {
+        question: t[question].replace(": *", "").replace("? *", "")
+        for question in QUESTIONS
+    }
@@ -0,0 +1,81 @@
+"""Anonymized rows for completed assessments.
+
+A stored result holds no identifiers: only the completion time, the
+language code, the score (points, tier, emergency override) and the
+answers as integer codes. Codes follow batch_scoring.py: the index of
+the option in OPTIONS, -1 when unanswered or hidden, and triggers as a
+bitmask over OPTIONS["triggers"]. Age is kept only as its band.
+
+Those positions change whenever a question or option is added, removed
+or reordered, so each stored row carries the LAYOUT_VERSION it was
+written with; init-db records every version's RESULT_LAYOUT in the
+result_layout table. The answer rollups store question and option codes,
+which do not move.
+"""
+import json
+import zlib
+from datetime import datetime
+
+from questionnaire import AGE_BANDS, CHOICE_QUESTIONS, OPTIONS
+from scoring import is_shown
+from translations import LANGUAGES
+
+# What a row's answer codes and trigger bits mean
+RESULT_LAYOUT = {
+    "questions": [[question, list(OPTIONS[question])]
+                  for question in CHOICE_QUESTIONS],
+    "triggers": list(OPTIONS["triggers"]),
+    "age_bands": [min_age for min_age, _ in AGE_BANDS],
+}
+LAYOUT_JSON = json.dumps(RESULT_LAYOUT, separators=(",", ":"))
+# Changes with the layout by itself; fits a 32-bit signed integer
+LAYOUT_VERSION = zlib.crc32(LAYOUT_JSON.encode()) & 0x7fffffff
+
+# (question number, code, question, option) for every answer a row can
+# hold: single-choice questions by position, then triggers by bit
+ANSWER_CODES = (
+    *((number, code, question, option)
+      for number, question in enumerate(CHOICE_QUESTIONS)
+      for code, option in enumerate(OPTIONS[question])),
+    *((len(CHOICE_QUESTIONS), bit, "triggers", trigger)
+      for bit, trigger in enumerate(OPTIONS["triggers"])),
+)
+
+
+def age_band(age):
+    """Return the index of age's band in AGE_BANDS, or -1 if unanswered."""
+    if age is None:
+        return -1
+    for band, (min_age, _) in enumerate(AGE_BANDS):
+        if age >= min_age:
+            return band
+    return len(AGE_BANDS)
+
+
+def encode_result(answers, points, emergency_override, tier, language,
+                  completed_at=None):
+    """Return the stored row for one scored assessment.
+
+    Rows are (completed_at, language, tier, emergency_override, points,
+    age_band, triggers, answer_codes).
+    """
+    codes = tuple(
+        OPTIONS[question].index(answers[question])
+        if answers.get(question) is not None and is_shown(question, answers)
+        else -1 for question in CHOICE_QUESTIONS)
+    triggers = 0
+    for trigger in answers.get("triggers") or ():
+        triggers |= 1 << OPTIONS["triggers"].index(trigger)
+    return (completed_at or datetime.now(), LANGUAGES.get(language, language),
+            tier, bool(emergency_override), int(points),
+            age_band(answers.get("age")), triggers, codes)
+
+
+def answer_counts(row):
+    """Yield the (question, option) codes a row adds to."""
+    for question, code in zip(CHOICE_QUESTIONS, row[7]):
+        if code >= 0:
+            yield question, OPTIONS[question][code]
+    for bit, trigger in enumerate(OPTIONS["triggers"]):
+        if row[6] & (1 << bit):
+            yield "triggers", trigger
@@ -0,0 +1,129 @@
+"""Risk scoring rules for the retinal detachment questionnaire.
+
+Answers are keyed on language-neutral codes (the translation keys used for
+each option, e.g. "yes", "myopia_high", "onset_24h") so the rules can run
+without Streamlit or a selected language.
+"""
+import os
+from functools import lru_cache
+
+# Rule tables compiled from the declarative schema
+from questionnaire import (AGE_BANDS, ANSWER_POINTS, EMERGENCY_ANSWERS,
+                           FOLLOW_UPS, REQUIRED, TRIGGER_POINTS)
+
+# Tier cutoffs as (minimum points, tier), checked from the highest down
+TIER_THRESHOLDS = ((15, "very_high"), (10, "high"), (5, "moderate"))
+TIERS = ("low", "moderate", "high", "very_high")
+
+# Distinct normalized answer sets kept by score_cached()
+SCORE_CACHE_SIZE = int(os.environ.get("SCORE_CACHE_SIZE", "4096"))
+
+
+def age_points(age):
+    if age is None:
+        return 0
+    for min_age, pts in AGE_BANDS:
+        if age >= min_age:
+            return pts
+    return 0
+
+
+def is_shown(question, answers):
+    """Return True if the question is visible given the other answers."""
+    if question not in FOLLOW_UPS:
+        return True
+    parent, reveal = FOLLOW_UPS[question]
+    return answers.get(parent) in reveal
+
+
+def risk_tier(points, emergency_override=False):
+    if emergency_override:
+        return "very_high"
+    for min_points, tier in TIER_THRESHOLDS:
+        if points >= min_points:
+            return tier
+    return "low"
+
+
+# (question, parent, reveal, points, emergency answer) per scored
+# question; parent is None for questions that are always shown
+_SCORED = tuple((question, *FOLLOW_UPS.get(question, (None, None)),
+                 answer_points, EMERGENCY_ANSWERS.get(question))
+                for question, answer_points in ANSWER_POINTS.items())
+
+
+def normalize_answers(answers):
+    """Reduce answers to the tuple of everything that affects the score.
+
+    Age becomes its band's points, hidden follow-ups become None and
+    triggers become one flag per trigger group, so answer sets that must
+    score alike share a key.
+    """
+    get = answers.get
+    triggers = get("triggers") or ()
+    return (
+        age_points(get("age")),
+        *[
+            get(question) if parent is None or get(parent) in reveal else None
+            for question, parent, reveal, _, _ in _SCORED
+        ],
+        *[
+            any(trigger in triggers for trigger in group)
+            for group, _ in TRIGGER_POINTS
+        ],
+    )
+
+
+def score_normalized(key):
+    """Score a normalize_answers() tuple; see score_assessment()."""
+    points = key[0]
+    emergency_override = False
+
+    for (_, _, _, answer_points, emergency), answer in zip(_SCORED, key[1:]):
+        if answer is None:
+            continue
+        points += answer_points.get(answer, 0)
+        if answer == emergency:
+            emergency_override = True
+
+    for (_, pts), hit in zip(TRIGGER_POINTS, key[1 + len(ANSWER_POINTS):]):
+        if hit:
+            points += pts
+
+    return points, emergency_override, risk_tier(points, emergency_override)
+
+
+def score_assessment(answers):
+    """Score a dict of answer codes.
+
+    Returns a (points, emergency_override, tier) tuple. Unanswered
+    questions score nothing, and follow-ups only count while their parent
+    answer reveals them.
+    """
+    return score_normalized(normalize_answers(answers))
+
+
+_score_cached = lru_cache(maxsize=SCORE_CACHE_SIZE)(score_normalized)
+
+
+def score_cached(answers):
+    """score_assessment() memoized on the normalized answers."""
+    return _score_cached(normalize_answers(answers))
+
+
+def score_cache_info():
+    """Return the (hits, misses, maxsize, currsize) of score_cached()."""
+    return _score_cached.cache_info()
+
+
+def missing_answers(answers):
+    """Return the codes of required questions that are still unanswered."""
+    missing = []
+    for question in REQUIRED:
+        if not is_shown(question, answers):
+            continue
+        answer = answers.get(question)
+        if answer is None or (isinstance(answer, (list, tuple))
+                              and len(answer) == 0):
+            missing.append(question)
+    return missing
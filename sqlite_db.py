@@ -0,0 +1,382 @@
+"""Embedded SQLite storage backend for single-node deployments.
+
+Selected with DATABASE_URL=sqlite:///relative/path.db (or
+sqlite:////absolute/path.db). The database runs in WAL mode, so readers
+never block the telemetry writer, and each write_events() call is a
+single transaction. Every thread gets its own connection. The schema is
+created when the store is opened; there is no server to set up.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from results import (ANSWER_CODES, LAYOUT_JSON, LAYOUT_VERSION,
+                     answer_counts)
+from scoring import TIERS
+from storage import Storage, instrumented, month_start
+
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Rollup tables keyed by bucket size, with the strftime format of a bucket
+ROLLUP_TABLES = {
+    "hour": ("view_rollup_hourly", "%Y-%m-%d %H:00:00"),
+    "day": ("view_rollup_daily", "%Y-%m-%d 00:00:00"),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS view_counter (
+    counter_name TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO view_counter (counter_name, count)
+VALUES ('assessments', 0), ('page_views', 0);
+CREATE TABLE IF NOT EXISTS view_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    view_type TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS view_log_timestamp_id ON view_log (timestamp, id);
+CREATE TABLE IF NOT EXISTS view_rollup_hourly (
+    bucket TEXT NOT NULL,
+    view_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (bucket, view_type)
+);
+CREATE TABLE IF NOT EXISTS view_rollup_daily (
+    bucket TEXT NOT NULL,
+    view_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (bucket, view_type)
+);
+CREATE TABLE IF NOT EXISTS assessment_result (
+    completed_at TEXT NOT NULL,
+    layout INTEGER NOT NULL,
+    language TEXT NOT NULL,
+    tier TEXT NOT NULL,
+    emergency_override INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    age_band INTEGER NOT NULL,
+    triggers INTEGER NOT NULL,
+    answers TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS assessment_result_completed_at
+ON assessment_result (completed_at);
+CREATE TABLE IF NOT EXISTS result_rollup_daily (
+    bucket TEXT NOT NULL,
+    language TEXT NOT NULL,
+    tier TEXT NOT NULL,
+    emergency_override INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (bucket, language, tier, emergency_override)
+);
+CREATE TABLE IF NOT EXISTS result_layout (
+    layout INTEGER PRIMARY KEY,
+    questions TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS answer_rollup_daily (
+    bucket TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (bucket, question, answer)
+);
+"""
+
+# Day bucket format shared by the result rollups
+DAY = ROLLUP_TABLES["day"][1]
+
+
+def path_from_url(url):
+    return url.split(":///", 1)[1] if ":///" in url else url.split(":", 1)[1]
+
+
+def _format(timestamp):
+    # Fixed-width text sorts in time order
+    return timestamp.isoformat(" ", timespec="microseconds")
+
+
+def _column_type(conn, table, column):
+    for row in conn.execute(f"PRAGMA table_info({table})"):
+        if row[1] == column:
+            return row[2]
+    return None
+
+
+def _format_bucket(since):
+    # Buckets are stored to the second; a fractional since is rounded up
+    # so bucket >= since compares like it does in Postgres
+    if since.microsecond:
+        since = since.replace(microsecond=0) + timedelta(seconds=1)
+    return since.isoformat(" ", timespec="seconds")
+
+
+class SQLiteStorage(Storage):
+
+    def __init__(self, url):
+        self.path = path_from_url(url)
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.init_schema()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path,
+                                   timeout=BUSY_TIMEOUT_MS / 1000,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back if the block raises."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @instrumented("init_schema")
+    def init_schema(self):
+        with self._transaction() as conn:
+            positional = _column_type(conn, "answer_rollup_daily",
+                                      "question") == "INTEGER"
+            if positional:
+                conn.execute("ALTER TABLE answer_rollup_daily "
+                             "RENAME TO answer_rollup_daily_positional")
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            # Rows from before layouts were recorded used the layout of the
+            # code that upgrades them
+            if _column_type(conn, "assessment_result", "layout") is None:
+                conn.execute("ALTER TABLE assessment_result ADD COLUMN layout "
+                             f"INTEGER NOT NULL DEFAULT {LAYOUT_VERSION}")
+            conn.execute("INSERT OR IGNORE INTO result_layout VALUES (?, ?)",
+                         (LAYOUT_VERSION, LAYOUT_JSON))
+            if positional:
+                self._upgrade_answer_rollup(conn)
+
+    def _upgrade_answer_rollup(self, conn):
+        # Rollups keyed by position are taken to match the current layout
+        codes = {(number, code): (question, answer)
+                 for number, code, question, answer in ANSWER_CODES}
+        rows = conn.execute("SELECT bucket, question, answer, count "
+                            "FROM answer_rollup_daily_positional")
+        conn.executemany(
+            "INSERT INTO answer_rollup_daily (bucket, question, answer, count) "
+            "VALUES (?, ?, ?, ?)",
+            [(bucket, *codes[number, code], count)
+             for bucket, number, code, count in rows
+             if (number, code) in codes])
+        conn.execute("DROP TABLE answer_rollup_daily_positional")
+
+    def is_unavailable(self, error):
+        # Locked or unreadable database files; constraint and data errors
+        # are rejections
+        return isinstance(error, sqlite3.OperationalError)
+
+    @instrumented("write_events")
+    def write_events(self, batches):
+        written = 0
+        with self._transaction() as conn:
+            for counts, log_rows, results in batches:
+                if results:
+                    self._write_results(conn, results)
+                if not log_rows:
+                    continue
+                conn.executemany(
+                    """
+                    INSERT INTO view_counter (counter_name, count)
+                    VALUES (?, ?)
+                    ON CONFLICT (counter_name)
+                    DO UPDATE SET count = count + excluded.count
+                """, sorted(counts.items()))
+                conn.executemany(
+                    "INSERT INTO view_log (view_type, timestamp) "
+                    "VALUES (?, ?)",
+                    [(view_type, _format(timestamp))
+                     for view_type, timestamp in log_rows])
+                for table, bucket_format in ROLLUP_TABLES.values():
+                    buckets = Counter(
+                        (timestamp.strftime(bucket_format), view_type)
+                        for view_type, timestamp in log_rows)
+                    conn.executemany(
+                        f"""
+                        INSERT INTO {table} (bucket, view_type, count)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT (bucket, view_type)
+                        DO UPDATE SET count = count + excluded.count
+                    """, [(bucket, view_type, n)
+                          for (bucket, view_type), n in buckets.items()])
+                written += len(log_rows)
+        return written
+
+    def _write_results(self, conn, results):
+        # Answer codes are stored as JSON arrays
+        conn.executemany(
+            """
+            INSERT INTO assessment_result (
+                completed_at, layout, language, tier, emergency_override,
+                points, age_band, triggers, answers)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(_format(completed_at), LAYOUT_VERSION, language, tier,
+               int(emergency), points, band, triggers,
+               json.dumps(codes, separators=(",", ":")))
+              for completed_at, language, tier, emergency, points, band,
+              triggers, codes in results])
+        tiers = Counter((row[0].strftime(DAY), row[1], row[2], int(row[3]))
+                        for row in results)
+        conn.executemany(
+            """
+            INSERT INTO result_rollup_daily (
+                bucket, language, tier, emergency_override, count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (bucket, language, tier, emergency_override)
+            DO UPDATE SET count = count + excluded.count
+        """, [(*key, n) for key, n in sorted(tiers.items())])
+        answers = Counter((row[0].strftime(DAY), *answer)
+                          for row in results for answer in answer_counts(row))
+        conn.executemany(
+            """
+            INSERT INTO answer_rollup_daily (bucket, question, answer, count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (bucket, question, answer)
+            DO UPDATE SET count = count + excluded.count
+        """, [(*key, n) for key, n in sorted(answers.items())])
+
+    @instrumented("get_counter")
+    def get_counter(self, counter_name='assessments'):
+        row = self._connection().execute(
+            "SELECT count FROM view_counter WHERE counter_name = ?",
+            (counter_name, )).fetchone()
+        return row[0] if row else 0
+
+    @instrumented("get_rollups")
+    def get_rollups(self, field, since):
+        table = ROLLUP_TABLES[field][0]
+        rows = self._connection().execute(
+            f"""
+            SELECT bucket, view_type, count FROM {table}
+            WHERE bucket >= ?
+            ORDER BY bucket
+        """, (_format_bucket(since), ))
+        return [(datetime.fromisoformat(bucket), view_type, count)
+                for bucket, view_type, count in rows]
+
+    @instrumented("get_tier_counts")
+    def get_tier_counts(self, since=None):
+        rows = self._connection().execute(
+            """
+            SELECT language, tier, sum(count),
+                   sum(CASE WHEN emergency_override THEN count ELSE 0 END)
+            FROM result_rollup_daily
+            WHERE bucket >= ?
+            GROUP BY language, tier
+        """, (_format_bucket(since or datetime.min), ))
+        return sorted(rows, key=lambda row: (TIERS.index(row[1]), row[0]))
+
+    @instrumented("get_answer_prevalence")
+    def get_answer_prevalence(self, since=None):
+        since = _format_bucket(since or datetime.min)
+        rows = self._connection().execute(
+            """
+            SELECT question, answer, sum(count),
+                   CAST(sum(count) AS REAL) / (SELECT sum(count)
+                                               FROM result_rollup_daily
+                                               WHERE bucket >= ?)
+            FROM answer_rollup_daily
+            WHERE bucket >= ?
+            GROUP BY question, answer
+            ORDER BY question, answer
+        """, (since, since))
+        return rows.fetchall()
+
+    @instrumented("get_view_log_page")
+    def get_view_log_page(self, limit=50, before=None, after_id=None):
+        conditions = []
+        params = []
+        if before is not None:
+            conditions.append("(timestamp, id) < (?, ?)")
+            params.extend((_format(before[0]), before[1]))
+        if after_id is not None:
+            conditions.append("id > ?")
+            params.append(after_id)
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        rows = self._connection().execute(
+            f"""
+            SELECT id, view_type, timestamp FROM view_log
+            {where}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        """, params + [limit])
+        return [(id_, view_type, datetime.fromisoformat(timestamp))
+                for id_, view_type, timestamp in rows]
+
+    def _write_csv(self, out, query, params=()):
+        # Rows are written as they are read, so memory use stays flat
+        text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+        try:
+            writer = csv.writer(text)
+            writer.writerow(["Type", "Timestamp"])
+            writer.writerows(self._connection().execute(query, params))
+            text.flush()
+        finally:
+            text.detach()
+
+    @instrumented("copy_view_log_csv")
+    def copy_view_log_csv(self, out):
+        self._write_csv(
+            out, "SELECT view_type, timestamp FROM view_log "
+            "ORDER BY timestamp DESC")
+
+    @instrumented("apply_retention")
+    def apply_retention(self, keep_months, archive_dir=None):
+        cutoff = _format(month_start(datetime.now(), -keep_months))
+        months = [
+            row[0] for row in self._connection().execute(
+                """
+            SELECT DISTINCT substr(timestamp, 1, 7) FROM view_log
+            WHERE timestamp < ? ORDER BY 1
+        """, (cutoff, ))
+        ]
+        dropped = []
+        for month in months:
+            year, number = month.split("-")
+            name = f"view_log_y{year}m{number}"
+            start = f"{month}-01"
+            end = _format(month_start(datetime(int(year), int(number), 1), 1))
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+                with gzip.open(os.path.join(archive_dir, f"{name}.csv.gz"),
+                               "wb") as out:
+                    self._write_csv(
+                        out, "SELECT view_type, timestamp FROM view_log "
+                        "WHERE timestamp >= ? AND timestamp < ? "
+                        "ORDER BY timestamp", (start, end))
+            with self._transaction() as conn:
+                conn.execute(
+                    "DELETE FROM view_log "
+                    "WHERE timestamp >= ? AND timestamp < ?", (start, end))
+            dropped.append(name)
+        return dropped
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
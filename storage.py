@@ -0,0 +1,171 @@
+"""Storage interface for counters, the view log, rollups and exports.
+
+The backend is chosen by DATABASE_URL: a sqlite:///path URL selects the
+embedded SQLite store (sqlite_db.py), anything else Postgres (db.py).
+Backend modules are imported on first use, so SQLite deployments never
+load psycopg2.
+"""
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from functools import wraps
+
+from breaker import CircuitOpenError
+from metrics import DB_LATENCY
+from timing import timed
+
+
+def instrumented(operation):
+    """Record every call in the timing spans and the DB latency metric."""
+
+    def decorate(func):
+        timed_func = timed(f"db.{operation}")(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return timed_func(*args, **kwargs)
+            finally:
+                DB_LATENCY.observe(time.perf_counter() - start,
+                                   operation=operation)
+
+        return wrapper
+
+    return decorate
+
+
+def month_start(timestamp, months_ahead=0):
+    """Return the start of timestamp's month, shifted by months_ahead."""
+    month = timestamp.year * 12 + timestamp.month - 1 + months_ahead
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+class Storage(ABC):
+    """Operations the app, telemetry writer and CLI need from a backend.
+
+    View log rows are (id, view_type, timestamp); rollup rows are
+    (bucket, view_type, count). Timestamps are naive local datetimes.
+    """
+
+    # CircuitBreaker guarding the backend, for backends that have one
+    breaker = None
+
+    @abstractmethod
+    def init_schema(self):
+        """Create or upgrade the tables."""
+
+    def maintain(self):
+        """Periodic upkeep, such as creating upcoming partitions."""
+
+    @abstractmethod
+    def write_events(self, batches):
+        """Write (counts, log_rows, results) batches in one transaction.
+
+        counts maps counter names to increments, log_rows holds
+        (view_type, timestamp) pairs and results holds
+        results.encode_result() rows; each batch also updates the view and
+        result rollups. Returns the number of log rows written.
+        """
+
+    def write_batch(self, counts, log_rows, results=()):
+        """Write one batch, in as few round trips as the backend allows."""
+        return self.write_events([(counts, log_rows, results)])
+
+    def is_unavailable(self, error):
+        """Return True if error means the backend could not be reached.
+
+        Other errors mean it answered and rejected the request, so
+        retrying the same rows cannot help.
+        """
+        return isinstance(error, CircuitOpenError)
+
+    @abstractmethod
+    def get_counter(self, counter_name='assessments'):
+        """Return the total of a counter (0 if it was never written)."""
+
+    @abstractmethod
+    def get_rollups(self, field, since):
+        """Return rollup rows for field "hour" or "day" since a time."""
+
+    @abstractmethod
+    def get_tier_counts(self, since=None):
+        """Return (language, tier, assessments, emergency overrides) rows.
+
+        Counts cover results completed since a time (all time for None),
+        in tier order.
+        """
+
+    @abstractmethod
+    def get_answer_prevalence(self, since=None):
+        """Return (question, option, count, share) rows since a time.
+
+        question and option are codes, which may include ones since
+        removed from the questionnaire. share is the fraction of all
+        assessments in the period that gave the answer; each selected
+        trigger counts as an answer.
+        """
+
+    @abstractmethod
+    def get_view_log_page(self, limit=50, before=None, after_id=None):
+        """Return up to limit view log rows, newest first.
+
+        before is the (timestamp, id) key the page starts before; after_id
+        keeps only rows with a higher id, whatever their timestamp. Ids
+        may commit out of order, so pollers re-read a margin below the
+        highest id seen.
+        """
+
+    @abstractmethod
+    def copy_view_log_csv(self, out):
+        """Stream the full view log as CSV into a binary file object."""
+
+    @abstractmethod
+    def apply_retention(self, keep_months, archive_dir=None):
+        """Drop raw view log months older than keep_months whole months.
+
+        With archive_dir set, each month is first saved there as a
+        gzipped CSV file. Returns the names of the dropped months.
+        """
+
+    def close(self):
+        pass
+
+
+def is_sqlite(url):
+    return bool(url) and url.startswith("sqlite:")
+
+
+def open_storage(url=None, **pool_options):
+    """Open a new storage for url (default DATABASE_URL).
+
+    pool_options are passed to db.ConnectionPool for Postgres.
+    """
+    url = url or os.environ.get("DATABASE_URL")
+    if is_sqlite(url):
+        import sqlite_db
+        return sqlite_db.SQLiteStorage(url)
+    import db
+    return db.PostgresStorage(db.ConnectionPool(url, **pool_options))
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the process-wide storage, opening it on first use."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                url = os.environ.get("DATABASE_URL")
+                if is_sqlite(url):
+                    import sqlite_db
+                    _storage = sqlite_db.SQLiteStorage(url)
+                else:
+                    import db
+                    _storage = db.PostgresStorage(db.get_pool())
+    return _storage
@@ -0,0 +1,349 @@
+"""Write-behind recording of page views and assessments.
+
+The Streamlit script thread only appends to an in-memory buffer, and
+the storage backend is only opened by the writer thread. A
+background thread coalesces counter increments, batches view_log rows,
+and hands them to Storage.write_batch(), which writes counters, log
+and rollups in one transaction, every flush_interval seconds, or sooner
+once max_events events are waiting.
+
+Anonymized assessment results (see results.py) ride along in the same
+batches.
+
+When a write fails, or the database breaker is open, the batch is
+appended to a local spool file instead of being dropped. The spool is
+replayed in bulk, REPLAY_BATCH rows per transaction, on the first flush
+after the database is reachable again, and before the new batch is
+written; a replay that fails does not keep the new batch out. Spooled lines that no longer parse, such as
+one cut short by a crash, and batches the database rejects are moved to
+a .bad file beside the spool.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+
+from breaker import CircuitOpenError
+from questionnaire import CHOICE_QUESTIONS, OPTIONS
+
+logger = logging.getLogger(__name__)
+
+SPOOL_PATH = os.environ.get(
+    "TELEMETRY_SPOOL",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 "telemetry.spool"))
+
+# Spooled rows written per batch while replaying
+REPLAY_BATCH = 10_000
+
+# First field of spool lines holding an assessment result. Answers are
+# spooled as question=option codes, so rows spooled before a questionnaire change
+# are re-encoded for the new layout on replay; POSITIONAL_RESULT_LINE
+# marks lines from before that, which hold answer positions.
+RESULT_LINE = "result_codes"
+POSITIONAL_RESULT_LINE = "result"
+
+
+def _result_line(row):
+    completed_at, language, tier, emergency, points, band, triggers, codes = row
+    answers = (f"{question}={OPTIONS[question][code]}"
+               for question, code in zip(CHOICE_QUESTIONS, codes) if code >= 0)
+    selected = (trigger for bit, trigger in enumerate(OPTIONS["triggers"])
+                if triggers & (1 << bit))
+    return "\t".join((RESULT_LINE, completed_at.isoformat(), language, tier,
+                      str(int(emergency)), str(points), str(band),
+                      "|".join(selected), ",".join(answers))) + "\n"
+
+
+def _parse_result(fields):
+    completed_at, language, tier, emergency, points, band, triggers, answers = (
+        fields)
+    # Codes no longer in the questionnaire count as unanswered
+    answers = dict(answer.split("=", 1) for answer in answers.split(",")
+                   if answer)
+    codes = tuple(
+        OPTIONS[question].index(answers[question])
+        if answers.get(question) in OPTIONS[question] else -1
+        for question in CHOICE_QUESTIONS)
+    selected = triggers.split("|")
+    mask = 0
+    for bit, trigger in enumerate(OPTIONS["triggers"]):
+        if trigger in selected:
+            mask |= 1 << bit
+    return (datetime.fromisoformat(completed_at), language, tier,
+            emergency == "1", int(points), int(band), mask, codes)
+
+
+def _parse_positional_result(fields):
+    completed_at, language, tier, emergency, *numbers, codes = fields
+    return (datetime.fromisoformat(completed_at), language, tier,
+            emergency == "1", *map(int, numbers),
+            tuple(int(code) for code in codes.split(",")))
+
+
+def _ends_mid_line(path):
+    try:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+    except OSError:
+        # Missing or empty
+        return False
+
+
+class TelemetryWriter:
+
+    def __init__(self, get_storage, flush_interval=0.5, max_events=500,
+                 spool_path=SPOOL_PATH):
+        # get_storage is called from the writer thread, so opening the
+        # storage (and any connection error) never happens on the script
+        # thread
+        self.get_storage = get_storage
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self.spool_path = spool_path
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        # Counts this process spooled that are not in the database yet
+        self._spooled = Counter()
+        self._replaying = Counter()
+        self._log_rows = []
+        self._results = []
+        self._wake = threading.Event()
+        self._stopping = False
+        self._maintained_month = None
+        self._thread = threading.Thread(target=self._run,
+                                        name="telemetry-writer",
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def record(self, counter_name='assessments'):
+        """Queue one counter increment and its view_log row."""
+        with self._lock:
+            self._counts[counter_name] += 1
+            self._log_rows.append((counter_name, datetime.now()))
+            pending = len(self._log_rows)
+        if pending >= self.max_events:
+            self._wake.set()
+
+    def record_result(self, row):
+        """Queue one results.encode_result() row."""
+        with self._lock:
+            self._results.append(row)
+            pending = len(self._log_rows) + len(self._results)
+        if pending >= self.max_events:
+            self._wake.set()
+
+    def pending(self, counter_name=None):
+        """Return the number of events recorded but not yet written."""
+        with self._lock:
+            waiting = self._counts + self._spooled + self._replaying
+        if counter_name is None:
+            return sum(waiting.values())
+        return waiting[counter_name]
+
+    def spooled_events(self):
+        """Return the number of events this process has waiting on disk."""
+        with self._lock:
+            return sum((self._spooled + self._replaying).values())
+
+    def _take(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            log_rows, self._log_rows = self._log_rows, []
+            results, self._results = self._results, []
+        return counts, log_rows, results
+
+    def flush(self):
+        counts, log_rows, results = self._take()
+        if not log_rows and not results and not self._has_spool():
+            return 0
+        try:
+            storage = self.get_storage()
+        except Exception as e:
+            self._write_failed(e, counts, log_rows, results)
+            return 0
+        # A replay that fails never holds back the current batch
+        try:
+            replayed = self._replay_spool(storage)
+        except Exception as e:
+            replayed = 0
+            if not isinstance(e, CircuitOpenError):
+                logger.warning("Telemetry spool replay failed: %s", e)
+        if not log_rows and not results:
+            return replayed
+        try:
+            self._maintain(storage, datetime.now())
+            storage.write_batch(counts, log_rows, results)
+        except Exception as e:
+            self._write_failed(e, counts, log_rows, results)
+            return replayed
+        return replayed + len(log_rows)
+
+    def _write_failed(self, error, counts, log_rows, results):
+        if log_rows or results:
+            self._spool(counts, log_rows, results)
+        if not isinstance(error, CircuitOpenError):
+            logger.warning("Telemetry write failed: %s", error)
+
+    def _has_spool(self):
+        return (os.path.exists(self.spool_path)
+                or os.path.exists(self.spool_path + ".replay"))
+
+    def _spool(self, counts, log_rows, results):
+        """Append rows to the spool; only if that fails are they lost."""
+        lines = "".join(f"{view_type}\t{timestamp.isoformat()}\n"
+                        for view_type, timestamp in log_rows)
+        lines += "".join(map(_result_line, results))
+        try:
+            # Start on a fresh line if a crash cut the last append short
+            if _ends_mid_line(self.spool_path):
+                lines = "\n" + lines
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            self.dropped += len(log_rows) + len(results)
+            logger.exception("Dropped %d telemetry events",
+                             len(log_rows) + len(results))
+            return
+        with self._lock:
+            self._spooled += counts
+
+    def _replay_spool(self, storage):
+        """Write spooled rows to the database, then remove the spool.
+
+        The spool is first renamed aside, so rows spooled meanwhile start a
+        new file. The file is written in transactions of REPLAY_BATCH
+        lines. A batch the database rejects is set aside in the .bad file;
+        if the database cannot be reached, the lines not yet written stay
+        in place for the next flush.
+        """
+        replay_path = self.spool_path + ".replay"
+        replayed = 0
+        while True:
+            if not os.path.exists(replay_path):
+                try:
+                    os.replace(self.spool_path, replay_path)
+                except FileNotFoundError:
+                    break
+                with self._lock:
+                    self._replaying += self._spooled
+                    self._spooled = Counter()
+            unwritten = None
+            with open(replay_path, encoding="utf-8") as f:
+                for lines, batch in self._read_spool(f):
+                    try:
+                        replayed += storage.write_events([batch])
+                    except Exception as e:
+                        if not storage.is_unavailable(e):
+                            logger.warning("Spooled batch rejected: %s", e)
+                            self._set_aside(lines)
+                            continue
+                        if not isinstance(e, CircuitOpenError):
+                            logger.warning("Telemetry spool replay failed: %s",
+                                           e)
+                        unwritten = self._keep_unwritten(replay_path, lines, f)
+                        break
+            if unwritten is not None:
+                os.replace(unwritten, replay_path)
+                break
+            os.remove(replay_path)
+            with self._lock:
+                self._replaying = Counter()
+        if replayed:
+            logger.info("Replayed %d spooled telemetry events", replayed)
+        return replayed
+
+    def _keep_unwritten(self, replay_path, lines, f):
+        # Copy the failed batch and the rest of the file aside, so rows
+        # already written are not written twice on the next try
+        path = replay_path + ".tmp"
+        with open(path, "w", encoding="utf-8") as out:
+            out.writelines(lines)
+            out.writelines(f)
+        return path
+
+    def _read_spool(self, f):
+        """Yield (lines, (counts, log_rows, results)) batches of spooled rows.
+
+        Lines that do not parse, such as one cut short by a crash, are set
+        aside at once and left out of the batch.
+        """
+        while True:
+            lines = list(islice(f, REPLAY_BATCH))
+            if not lines:
+                return
+            parsed, bad_lines, log_rows, results = [], [], [], []
+            for line in lines:
+                try:
+                    if not line.endswith("\n"):
+                        raise ValueError("unterminated line")
+                    fields = line[:-1].split("\t")
+                    if fields[0] == RESULT_LINE:
+                        results.append(_parse_result(fields[1:]))
+                    elif fields[0] == POSITIONAL_RESULT_LINE:
+                        results.append(_parse_positional_result(fields[1:]))
+                    else:
+                        view_type, timestamp = fields
+                        log_rows.append(
+                            (view_type, datetime.fromisoformat(timestamp)))
+                    parsed.append(line)
+                except ValueError:
+                    bad_lines.append(line)
+            if bad_lines:
+                self._set_aside(bad_lines)
+            yield parsed, (Counter(view_type for view_type, _ in log_rows),
+                           log_rows, results)
+
+    def _set_aside(self, lines):
+        """Append spool lines that cannot be written to the .bad file."""
+        bad_path = self.spool_path + ".bad"
+        try:
+            with open(bad_path, "a", encoding="utf-8") as f:
+                f.writelines(line if line.endswith("\n") else line + "\n"
+                             for line in lines)
+        except OSError:
+            logger.exception("Dropped %d bad spool lines", len(lines))
+            return
+        logger.warning("Moved %d bad spool lines to %s", len(lines), bad_path)
+
+    def _maintain(self, storage, timestamp):
+        # Schema setup is left to `main.py init-db`; the writer only runs
+        # the backend's upkeep (view_log partitions ahead of the clock for
+        # Postgres), once a month
+        month = timestamp.strftime("%Y-%m")
+        if self._maintained_month == month:
+            return
+        try:
+            storage.maintain()
+            self._maintained_month = month
+        except CircuitOpenError:
+            raise
+        except Exception:
+            logger.exception("Storage maintenance failed")
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def stop(self, timeout=5.0):
+        """Stop the writer thread and write or spool what is buffered."""
+        if self._stopping:
+            return
+        self._stopping = True
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
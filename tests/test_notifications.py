@@ -0,0 +1,86 @@
+"""Digests against a local stub of the SendGrid endpoint."""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from notifications import NotificationDigest, make_session  # noqa: E402
+
+
+@pytest.fixture
+def stub():
+    """Serve POSTs with the queued status codes (202 once they run out)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.statuses = []
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.headers["Authorization"], body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 202
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def new_digest(stub, **options):
+    return NotificationDigest(
+        "key",
+        "admin@example.com",
+        url=f"http://127.0.0.1:{stub.server_port}/v3/mail/send",
+        get_total_views=lambda: 1234,
+        session=make_session(retries=0),
+        **options)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_digest_sent_once_max_visits_wait(stub):
+    digest = new_digest(stub, interval=60, max_visits=3).start()
+    for _ in range(3):
+        digest.record_visit()
+    assert wait_for(lambda: digest.sent == 1)
+    authorization, body = stub.requests[0]
+    assert authorization == "Bearer key"
+    assert body["subject"] == ("Retinal Risk App - New Visitors: 3 "
+                               "(Total: 1,234)")
+    digest.stop()
+    assert len(stub.requests) == 1
+
+
+def test_failed_digest_backs_off(stub):
+    stub.statuses = [503]
+    digest = new_digest(stub, interval=60, max_visits=1).start()
+    digest.record_visit()
+    assert wait_for(lambda: digest.failed == 1)
+    # Visits past max_visits do not retry before the interval is up
+    for _ in range(5):
+        digest.record_visit()
+    time.sleep(0.3)
+    assert len(stub.requests) == 1
+    digest.stop()
+    assert digest.sent == 1
+    assert stub.requests[-1][1]["subject"].startswith(
+        "Retinal Risk App - New Visitors: 6 ")
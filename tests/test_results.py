@@ -0,0 +1,61 @@
+"""Stored results stay readable when the questionnaire changes."""
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import telemetry  # noqa: E402
+from questionnaire import CHOICE_QUESTIONS, OPTIONS  # noqa: E402
+from results import LAYOUT_VERSION, RESULT_LAYOUT, encode_result  # noqa: E402
+from storage import open_storage  # noqa: E402
+
+ANSWERS = {
+    "sex": "male",
+    "shadow": "yes",
+    "shadow_onset": "onset_24h",
+    "triggers": ["trigger_sports", "not_sure"],
+}
+
+
+def test_rollups_are_keyed_on_codes(tmp_path):
+    storage = open_storage(f"sqlite:///{tmp_path / 'results.db'}")
+    row = encode_result(ANSWERS, 10, True, "very_high", "English")
+    storage.write_batch({}, [], [row, row])
+    prevalence = {(question, option): count
+                  for question, option, count, _ in
+                  storage.get_answer_prevalence()}
+    assert prevalence == {
+        ("sex", "male"): 2,
+        ("shadow", "yes"): 2,
+        ("shadow_onset", "onset_24h"): 2,
+        ("triggers", "trigger_sports"): 2,
+        ("triggers", "not_sure"): 2,
+    }
+    conn = storage._connection()
+    assert conn.execute("SELECT DISTINCT layout FROM assessment_result"
+                        ).fetchall() == [(LAYOUT_VERSION, )]
+    layout = conn.execute("SELECT questions FROM result_layout WHERE layout = ?",
+                          (LAYOUT_VERSION, )).fetchone()[0]
+    assert json.loads(layout) == RESULT_LAYOUT
+    storage.close()
+
+
+def test_spooled_result_follows_a_layout_change(monkeypatch):
+    row = encode_result(ANSWERS, 10, True, "very_high", "English")
+    line = telemetry._result_line(row)
+
+    # A new first question, and the sex options reordered
+    options = dict(OPTIONS, new_question=("no", "yes"),
+                   sex=tuple(reversed(OPTIONS["sex"])))
+    questions = ("new_question", *CHOICE_QUESTIONS)
+    monkeypatch.setattr(telemetry, "OPTIONS", options)
+    monkeypatch.setattr(telemetry, "CHOICE_QUESTIONS", questions)
+    parsed = telemetry._parse_result(line[:-1].split("\t")[1:])
+
+    codes = dict(zip(questions, parsed[7]))
+    assert codes["new_question"] == -1
+    assert options["sex"][codes["sex"]] == "male"
+    assert options["shadow_onset"][codes["shadow_onset"]] == "onset_24h"
+    assert parsed[6] == row[6]
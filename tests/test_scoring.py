@@ -0,0 +1,122 @@
+"""score_assessment(), score_cached() and score_batch() must agree."""
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from batch_scoring import TRIGGER_SEPARATOR, score_batch  # noqa: E402
+from main import read_chunks, score_chunk  # noqa: E402
+from questionnaire import OPTIONS, QUESTION_SPECS, widget_key  # noqa: E402
+from scoring import TIERS, score_assessment, score_cached  # noqa: E402
+
+
+def random_answers(rng):
+    """Return an answer dict; hidden follow-ups are answered too."""
+    answers = {}
+    for question in QUESTION_SPECS:
+        code = question["code"]
+        if rng.random() < 0.05:
+            continue
+        if question["widget"] == "number":
+            answers[code] = rng.randint(question["min"], question["max"])
+        elif question["widget"] == "multiselect":
+            answers[code] = [o for o in question["options"]
+                             if rng.random() < 0.3]
+        else:
+            answers[code] = rng.choice(question["options"])
+    return answers
+
+
+def batch_scores(assessments, **columns):
+    frame = pd.DataFrame(assessments)
+    for question, values in columns.items():
+        frame[question] = values
+    points, emergency_override, tier = score_batch(frame)
+    return [(int(p), bool(e), TIERS[t])
+            for p, e, t in zip(points, emergency_override, tier)]
+
+
+def test_single_cached_and_batch_agree():
+    rng = random.Random(0)
+    assessments = [random_answers(rng) for _ in range(2000)]
+    expected = [score_assessment(answers) for answers in assessments]
+    assert [score_cached(answers) for answers in assessments] == expected
+    assert batch_scores(assessments) == expected
+
+
+def test_hidden_follow_ups_score_nothing():
+    answers = {"shadow": "no", "shadow_onset": "onset_24h"}
+    assert score_assessment(answers) == (0, False, "low")
+    assert score_cached(answers) == (0, False, "low")
+    assert batch_scores([answers]) == [(0, False, "low")]
+
+    answers["shadow"] = "yes"
+    assert score_assessment(answers) == (10, True, "very_high")
+    assert batch_scores([answers]) == [(10, True, "very_high")]
+
+
+def test_flashes_onset_counts_for_either_widget():
+    for flashes, points in (("flashes_occasional", 3), ("flashes_frequent", 4)):
+        answers = {"flashes": flashes, "flashes_onset": "onset_48h"}
+        assert score_assessment(answers)[0] == points
+        assert score_cached(answers)[0] == points
+        assert batch_scores([answers])[0][0] == points
+    assert widget_key("flashes_onset", {"flashes": "flashes_frequent"},
+                      0) == "flashes_onset2_0"
+    assert widget_key("flashes_onset", {"flashes": "flashes_occasional"},
+                      0) == "flashes_onset_0"
+
+
+def test_trigger_groups_count_once():
+    selections = [
+        [],
+        ["trigger_trauma"],
+        ["trigger_trauma", "trigger_sports"],
+        ["trigger_lifting"],
+        ["trigger_sports", "trigger_lifting"],
+    ]
+    assessments = [{"triggers": triggers} for triggers in selections]
+    expected = [(0, False, "low"), (3, False, "low"), (3, False, "low"),
+                (1, False, "low"), (4, False, "low")]
+    assert [score_assessment(answers) for answers in assessments] == expected
+    assert [score_cached(answers) for answers in assessments] == expected
+    assert batch_scores(assessments) == expected
+    joined = [TRIGGER_SEPARATOR.join(triggers) for triggers in selections]
+    assert batch_scores(assessments, triggers=joined) == expected
+    masks = [sum(1 << OPTIONS["triggers"].index(t) for t in triggers)
+             for triggers in selections]
+    assert batch_scores(assessments, triggers=masks) == expected
+
+
+def test_out_of_range_codes_are_unanswered():
+    codes = np.array([0, 1, 2, -2, 5], dtype=np.int64)
+    points, _, _ = score_batch({"shadow": codes})
+    assert points.tolist() == [0, 8, 0, 0, 0]
+    points, _, _ = score_batch({"triggers": np.array([1, 255, -1])})
+    assert points.tolist() == [3, 0, 0]
+
+
+def test_trigger_cells_can_mix_masks_and_lists():
+    sports = 1 << OPTIONS["triggers"].index("trigger_sports")
+    triggers = [["trigger_sports"], sports, np.int64(sports),
+                "trigger_sports", 255, None]
+    points, _, _ = score_batch(pd.DataFrame({"triggers": triggers}))
+    assert points.tolist() == [3, 3, 3, 3, 0, 0]
+
+
+def test_csv_columns_pass_through_unchanged(tmp_path):
+    path = tmp_path / "answers.csv"
+    path.write_text("record_id,age,shadow,triggers\n"
+                    "1001,NA,yes,\n"
+                    ",,,\n"
+                    "1003,75,1,1\n")
+    chunks = [score_chunk(chunk) for chunk in read_chunks(path, "csv", 2)]
+    assert [chunk["record_id"].tolist() for chunk in chunks] == [
+        ["1001", ""], ["1003"]]
+    # shadow holds an option code in one row and an integer code in another
+    assert [chunk["points"].tolist() for chunk in chunks] == [[8, 0], [14]]
@@ -0,0 +1,99 @@
+"""Spooled telemetry survives torn writes and failed replays."""
+import os
+import sqlite3
+import sys
+from collections import Counter
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import telemetry  # noqa: E402
+from sqlite_db import SQLiteStorage  # noqa: E402
+from storage import open_storage  # noqa: E402
+from telemetry import TelemetryWriter  # noqa: E402
+
+
+def test_torn_spool_line_is_set_aside(tmp_path):
+    spool_path = str(tmp_path / "telemetry.spool")
+    storage = open_storage(f"sqlite:///{tmp_path / 'telemetry.db'}")
+    storage.init_schema()
+    writer = TelemetryWriter(lambda: storage, spool_path=spool_path)
+
+    # A crash cut this append short, then the app spooled more rows
+    with open(spool_path, "w", encoding="utf-8") as f:
+        f.write("page_views\t2026-10-18T10:0")
+    timestamp = datetime(2026, 10, 18, 10, 30)
+    writer._spool(Counter(page_views=2),
+                  [("page_views", timestamp), ("page_views", timestamp)], [])
+
+    assert writer.flush() == 2
+    assert storage.get_counter("page_views") == 2
+    assert not os.path.exists(spool_path)
+    assert not os.path.exists(spool_path + ".replay")
+    with open(spool_path + ".bad", encoding="utf-8") as f:
+        assert f.read() == "page_views\t2026-10-18T10:0\n"
+    storage.close()
+
+
+class FlakyStorage(SQLiteStorage):
+    """SQLite storage that rejects "rejected" rows and can be taken down."""
+
+    down_after = None
+
+    def write_events(self, batches):
+        batches = list(batches)
+        for _, log_rows, _ in batches:
+            if any(view_type == "rejected" for view_type, _ in log_rows):
+                raise ValueError("rejected row")
+        if self.down_after is not None:
+            if self.down_after == 0:
+                self.down_after = None
+                raise sqlite3.OperationalError("database is locked")
+            self.down_after -= 1
+        return super().write_events(batches)
+
+
+def spool_rows(writer, *view_types):
+    timestamp = datetime(2026, 10, 18, 10, 30)
+    writer._spool(Counter(view_types),
+                  [(view_type, timestamp) for view_type in view_types], [])
+
+
+def test_rejected_spool_batch_is_set_aside(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "REPLAY_BATCH", 2)
+    spool_path = str(tmp_path / "telemetry.spool")
+    storage = FlakyStorage(f"sqlite:///{tmp_path / 'telemetry.db'}")
+    writer = TelemetryWriter(lambda: storage, spool_path=spool_path)
+    spool_rows(writer, "page_views", "page_views", "rejected", "page_views")
+
+    writer.record("page_views")
+    # The first batch replays, the rejected one is set aside, and the
+    # new row is written all the same
+    assert writer.flush() == 3
+    writer.record("page_views")
+    assert writer.flush() == 1
+    assert storage.get_counter("page_views") == 4
+    assert not writer._has_spool()
+    with open(spool_path + ".bad", encoding="utf-8") as f:
+        assert [line.split("\t")[0] for line in f] == ["rejected",
+                                                       "page_views"]
+    storage.close()
+
+
+def test_replay_resumes_after_the_database_goes_down(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "REPLAY_BATCH", 2)
+    spool_path = str(tmp_path / "telemetry.spool")
+    storage = FlakyStorage(f"sqlite:///{tmp_path / 'telemetry.db'}")
+    writer = TelemetryWriter(lambda: storage, spool_path=spool_path)
+    spool_rows(writer, *["page_views"] * 5)
+
+    storage.down_after = 1
+    writer.record("page_views")
+    assert writer.flush() == 3
+    assert writer._has_spool()
+    assert writer.flush() == 3
+    assert storage.get_counter("page_views") == 6
+    assert not writer._has_spool()
+    assert not os.path.exists(spool_path + ".bad")
+    storage.close()
@@ -0,0 +1,134 @@
+"""In-process timing spans for the app's hot paths.
+
+Set APP_TIMING=1 to record. Each span name gets a fixed-bucket histogram
+of durations in milliseconds, shared by every session in the process.
+When timing is off, span() returns a shared no-op context manager and
+timed() returns the function unchanged, so instrumented code pays next
+to nothing.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from functools import wraps
+
+ENABLED = os.environ.get("APP_TIMING") == "1"
+DUMP_PATH = os.environ.get("APP_TIMING_FILE", "timings.json")
+
+# Histogram bucket upper bounds in milliseconds; slower spans land in a
+# final overflow bucket
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500,
+           5000, 10000)
+
+_NO_SPAN = nullcontext()
+_histograms = {}
+_lock = threading.Lock()
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding quantile q."""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.max
+
+
+def observe(name, ms):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(ms)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+def span(name):
+    """Context manager timing its block under name."""
+    return _Span(name) if ENABLED else _NO_SPAN
+
+
+def timed(name):
+    """Decorator timing every call under name."""
+
+    def decorate(func):
+        if not ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def snapshot():
+    """Return one summary dict per span, slowest total first."""
+    with _lock:
+        rows = [{
+            "span": name,
+            "count": h.count,
+            "total_ms": round(h.total, 3),
+            "mean_ms": round(h.total / h.count, 3),
+            "p50_ms": h.quantile(0.5),
+            "p95_ms": h.quantile(0.95),
+            "max_ms": round(h.max, 3),
+            "buckets": dict(zip([*map(str, BUCKETS), "+Inf"], h.counts)),
+        } for name, h in _histograms.items()]
+    return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def dump(path=None):
+    """Write the current histograms to a JSON file and return its path."""
+    path = path or DUMP_PATH
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "spans": snapshot(),
+            },
+            f,
+            indent=2)
+        f.write("\n")
+    return path
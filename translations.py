@@ -0,0 +1,70 @@
+"""Per-language translation catalogs, loaded on first use.
+
+Each language lives in locales/<code>.json. A catalog is read the first
+time its language is requested and kept for the life of the process;
+keys it lacks fall back to English.
+"""
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "locales")
+
+# Display name shown in the language selector -> catalog file code
+LANGUAGES = {
+    "English": "en",
+    "Español": "es",
+    "हिंदी": "hi",
+}
+FALLBACK_LANGUAGE = "English"
+
+_catalogs = {}
+_lock = threading.RLock()
+
+
+def _read_catalog(language):
+    path = os.path.join(LOCALES_DIR, f"{LANGUAGES[language]}.json")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_translations(language):
+    """Return the translation dict for a language, loading it if needed."""
+    catalog = _catalogs.get(language)
+    if catalog is None:
+        with _lock:
+            catalog = _catalogs.get(language)
+            if catalog is None:
+                catalog = _read_catalog(language)
+                if language != FALLBACK_LANGUAGE:
+                    catalog = {
+                        **get_translations(FALLBACK_LANGUAGE),
+                        **catalog
+                    }
+                _catalogs[language] = catalog
+    return catalog
+
+
+def check_catalogs():
+    """Compare every catalog's keys against English.
+
+    Returns {language: (missing keys, extra keys)} for languages that
+    differ, logging a warning for each. Catalogs are read and discarded,
+    so the check does not keep unused languages in memory.
+    """
+    expected = set(_read_catalog(FALLBACK_LANGUAGE))
+    problems = {}
+    for language in LANGUAGES:
+        if language == FALLBACK_LANGUAGE:
+            continue
+        keys = set(_read_catalog(language))
+        missing, extra = sorted(expected - keys), sorted(keys - expected)
+        if missing or extra:
+            problems[language] = (missing, extra)
+            logger.warning("%s catalog: missing %s, extra %s", language,
+                           missing, extra)
+    return problems